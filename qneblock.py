@@ -25,14 +25,20 @@
 #SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from PySide.QtCore import (Qt)
+from PySide.QtCore import (Qt, QSizeF, QRectF)
 from PySide.QtGui import (QBrush, QColor, QPainter, QPainterPath, QPen)
 from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem, 
-    QGraphicsDropShadowEffect)
+    QGraphicsDropShadowEffect, QMenu)
 
-from qneport import QNEPort
+from qneport import (QNEPort, QNEPortStub)
+from qneconnection import QNEConnectionIndex
+from qnemetrics import QNEMetrics
+from qneshadow import QNEShadow
+from qneprofiler import QNEProfiler
 
 class QNEBlock(QGraphicsPathItem):
+    (HorzMargin, VertMargin) = (20, 5)
+    (PortPoolSize) = (16)
     (Type) = (QGraphicsItem.UserType +3)
 
     def __init__(self, parent):
@@ -52,6 +58,12 @@ class QNEBlock(QGraphicsPathItem):
         selectedColor.setAlphaF(0.8)
         self.selectedBrush.setColor(selectedColor)
 
+        self.highlightBrush = QApplication.palette().highlight()
+        highlightColor = self.highlightBrush.color()
+        highlightColor.setAlphaF(0.8)
+        self.highlightBrush.setColor(highlightColor)
+        self.m_highlighted = False
+
         self.pen = QPen(QApplication.palette().text().color(), 1)
 
         path = QPainterPath()
@@ -61,16 +73,36 @@ class QNEBlock(QGraphicsPathItem):
         self.setFlag(QGraphicsItem.ItemIsMovable)
         self.setFlag(QGraphicsItem.ItemIsSelectable)
 
-        self.effect = QGraphicsDropShadowEffect(None)
-        self.effect.setBlurRadius(8)
-        self.effect.setOffset(2,2)
-        self.setGraphicsEffect(self.effect)
+        self.effect = None
+        self.updateShadow()
 
-        self.horzMargin = 20
-        self.vertMargin = 5
+        self.horzMargin = self.HorzMargin
+        self.vertMargin = self.VertMargin
         self.width = self.horzMargin
         self.height = self.vertMargin
 
+        self.m_updateDepth = 0
+        self.m_layoutDirty = False
+        self.m_detailLevel = QNEPort.FullDetail
+
+        # virtual ports are only known by their specs; the visible slice of
+        # them is bound to a pool of at most portPoolSize port items, and
+        # the connections of the others end at a stub on the block edge
+        self.portPoolSize = self.PortPoolSize
+        self.m_fixedPorts = []
+        self.m_specs = []
+        self.m_specIndex = {}
+        self.m_specWidth = 0
+        self.m_pool = []
+        self.m_boundPorts = {}
+        self.m_pinned = set()
+        self.m_scrollOffset = 0
+        self.m_collapsed = False
+        self.m_footerRect = None
+        self.m_footerText = ""
+        self.m_inputStub = QNEPortStub(self, False)
+        self.m_outputStub = QNEPortStub(self, True)
+
 
     def __del__(self):
         #print("Del QNEBlock")
@@ -82,19 +114,58 @@ class QNEBlock(QGraphicsPathItem):
             for connection in port.connections():
                 connection.delete()
             port.delete()
+        self.m_inputStub.delete()
+        self.m_outputStub.delete()
         if self.scene():
             self.scene().removeItem(self)
 
 
+    @QNEProfiler.timed("QNEBlock.paint")
     def paint(self, painter, option, widget):
         if self.isSelected():
-            painter.setBrush(self.selectedBrush)
+            brush = self.selectedBrush
+        elif self.m_highlighted:
+            brush = self.highlightBrush
         else:
-            painter.setBrush(self.normalBrush)
+            brush = self.normalBrush
+
+        if self.m_detailLevel >= QNEPort.OutlineDetail:
+            # too small to make out the rounded corners and outline
+            painter.fillRect(self.path().boundingRect(), brush)
+            return
+
+        if QNEShadow.isActive(QNEShadow.CachedShadow):
+            QNEShadow.paint(painter, self.path().boundingRect())
+
+        painter.setBrush(brush)
         painter.setPen(self.pen)
 
         painter.drawPath(self.path())
 
+        if self.m_footerRect and self.m_detailLevel <= QNEPort.LabelDetail:
+            painter.setFont(self.scene().font())
+            painter.drawText(self.m_footerRect, Qt.AlignCenter, self.m_footerText)
+
+
+    def boundingRect(self):
+        # leave room for the cached shadow
+        margin = QNEShadow.margin()
+        return super(QNEBlock, self).boundingRect().adjusted(-margin, -margin, margin, margin)
+
+
+    def updateShadow(self):
+        if QNEShadow.isActive(QNEShadow.EffectShadow):
+            if not self.effect:
+                self.effect = QGraphicsDropShadowEffect(None)
+                self.effect.setBlurRadius(QNEShadow.blurRadius)
+                self.effect.setOffset(QNEShadow.offset, QNEShadow.offset)
+                self.setGraphicsEffect(self.effect)
+        elif self.effect:
+            self.setGraphicsEffect(None)
+            self.effect = None
+
+        self.update()
+
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.ItemSelectedHasChanged:
@@ -104,35 +175,385 @@ class QNEBlock(QGraphicsPathItem):
 
 
     def addPort(self, name, hasInput = False, hasOutput = False, flags = 0):
+        port = self.createPort(name, hasInput, hasOutput, flags)
+        self.m_fixedPorts.append(port)
+        self.requestLayout()
+
+        return port
+
+
+    def createPort(self, name, hasInput, hasOutput, flags = 0):
         port = QNEPort(self)
         port.setName(name)
         port.setCanConnect(hasInput, hasOutput)
         port.setNEBlock(self)
         port.setPortFlags(flags)
+        port.setDetailLevel(self.m_detailLevel)
+
+        return port
+
+
+    def requestLayout(self):
+        if self.m_updateDepth > 0:
+            self.m_layoutDirty = True
+        else:
+            self.updateLayout()
+
+
+    def addPorts(self, specs):
+        # specs are (name, hasInput, hasOutput, flags) tuples; flags and
+        # the connectability may be omitted
+        self.beginUpdate()
+        ports = [self.addPort(*spec) for spec in specs]
+        self.endUpdate()
+
+        return ports
+
+
+    def beginUpdate(self):
+        self.m_updateDepth += 1
+
+
+    def endUpdate(self):
+        self.m_updateDepth -= 1
+        if self.m_updateDepth == 0 and self.m_layoutDirty:
+            self.updateLayout()
+
+
+    @QNEProfiler.timed("QNEBlock.updateLayout")
+    def updateLayout(self):
+        self.m_layoutDirty = False
 
-        innerSize = port.innerSize()
-        width = innerSize.width()
-        height = innerSize.height()
-        if width > self.width - self.horzMargin:
-            self.width = width + self.horzMargin
-        self.height += height
+        ports = self.m_fixedPorts + self.m_pool
+        sizes = [port.innerSize() for port in ports]
+
+        # all virtual ports count for the width, so scrolling does not
+        # resize the block
+        self.width = self.m_specWidth + self.horzMargin
+        self.height = self.vertMargin
+        for size in sizes:
+            if size.width() > self.width - self.horzMargin:
+                self.width = size.width() + self.horzMargin
+            self.height += size.height()
+
+        footerHeight = 0
+        if self.hasFooter():
+            footerHeight = QNEMetrics.lineHeight(self.scene().font())
+        self.height += footerHeight
 
         path = QPainterPath()
         path.addRoundedRect(-self.width/2, -self.height/2, self.width, self.height, 5, 5)
         self.setPath(path)
 
-        y = -self.height / 2 + self.vertMargin + port.radius()
-        for port_ in self.childItems():
-            if port_.type() != QNEPort.Type:
-                continue
+        y = -self.height / 2 + self.vertMargin
+        for port, size in zip(ports, sizes):
+            port.setPos(-self.width/2 - port.radius(), y + port.radius())
+            port.setWidth(self.width)
+            y += size.height()
+
+        if footerHeight:
+            self.m_footerRect = QRectF(-self.width/2, y, self.width, footerHeight)
+            if self.m_collapsed:
+                self.m_footerText = "%d ports" % len(self.m_specs)
+            else:
+                # the scrolled range of the ports that are not pinned
+                shown = len(self.m_pool) - len(self.m_pinned)
+                self.m_footerText = "%d-%d of %d" % (self.m_scrollOffset + 1,
+                    self.m_scrollOffset + shown, len(self.m_specs) - len(self.m_pinned))
+        else:
+            self.m_footerRect = None
+        self.m_inputStub.setPos(-self.width/2 - self.m_inputStub.radius(), y + footerHeight/2)
+        self.m_outputStub.setPos(self.width/2 - self.m_outputStub.radius(), y + footerHeight/2)
+        self.update()
 
-            port_.setPos(-self.width/2 - port.radius(), y)
-            port_.setWidth(self.width)
-            y += port_.innerSize().height()
 
-        return port
+    def hasFooter(self):
+        return bool(self.m_specs) and (self.m_collapsed or len(self.m_specs) > self.portPoolSize)
+
+
+    def addVirtualPorts(self, specs):
+        # specs are (name, hasInput, hasOutput) tuples
+        font = QNEMetrics.styledFont(self.scene().font(), QNEMetrics.PlainStyle)
+        for spec in specs:
+            self.m_specIndex[spec[0]] = len(self.m_specs)
+            self.m_specs.append(spec)
+            self.m_specWidth = max(self.m_specWidth,
+                QNEMetrics.textWidth(font, spec[0]) + QNEPort.WidgetWidth)
+
+        self.updateSlice()
+
+
+    def hasPort(self, name):
+        return name in self.m_specIndex
+
+
+    def boundPort(self, name):
+        return self.m_boundPorts.get(name)
+
+
+    def inputEndpoint(self, name):
+        # the item connections to a virtual port end at
+        port = self.m_boundPorts.get(name)
+        return port if port else self.m_inputStub
+
+
+    def outputEndpoint(self, name):
+        # the item connections from a virtual port start at, or None if it
+        # does not emit
+        if name not in self.m_specIndex or not self.m_specs[self.m_specIndex[name]][2]:
+            return None
+        port = self.m_boundPorts.get(name)
+        return port.outputPort if port else self.m_outputStub
+
+
+    def visibleNames(self):
+        if self.m_collapsed:
+            return []
+
+        pinned = sorted(self.m_pinned, key=self.m_specIndex.get)
+        rows = max(0, self.portPoolSize - len(pinned))
+        unpinned = [spec[0] for spec in self.m_specs if spec[0] not in self.m_pinned]
+
+        return pinned + unpinned[self.m_scrollOffset:self.m_scrollOffset + rows]
+
+
+    def maxScrollOffset(self):
+        if self.m_collapsed:
+            return 0
+        rows = self.portPoolSize - len(self.m_pinned)
+        return max(0, len(self.m_specs) - len(self.m_pinned) - rows)
+
+
+    @QNEProfiler.timed("QNEBlock.updateSlice")
+    def updateSlice(self):
+        names = self.visibleNames()
+        visible = set(names)
+
+        free = []
+        for name in list(self.m_boundPorts):
+            if name not in visible:
+                port = self.m_boundPorts.pop(name)
+                self.unbindPort(port, name)
+                free.append(port)
+
+        pool = []
+        for name in names:
+            port = self.m_boundPorts.get(name)
+            if port is None:
+                port = free.pop() if free else self.createPort(name, False, False)
+                self.bindPort(port, name)
+            pool.append(port)
+
+        # only left over when the slice got smaller
+        for port in free:
+            port.delete()
+
+        self.m_pool = pool
+        self.requestLayout()
+
+
+    def bindPort(self, port, name):
+        (name, hasInput, hasOutput) = self.m_specs[self.m_specIndex[name]]
+        port.setName(name)
+        port.setCanConnect(hasInput, hasOutput)
+        port.setHistory(None)
+        self.m_boundPorts[name] = port
+
+        # take over the connections of this port from the stubs
+        peer = QNEConnectionIndex.peerKey(self)
+        for connection in self.m_inputStub.connections():
+            key = connection.key()
+            if key and key[2] == peer and key[3] == name:
+                connection.rebind(self.m_inputStub, port)
+        if hasOutput:
+            for connection in self.m_outputStub.connections():
+                key = connection.key()
+                if key and key[0] == peer and key[1] == name:
+                    connection.rebind(self.m_outputStub, port.outputPort)
+
+        if hasattr(self.m_nodeEditor, "onBindPort"):
+            self.m_nodeEditor.onBindPort(self, port)
+
+
+    def unbindPort(self, port, name):
+        for connection in port.connections():
+            ends = (connection.port1(), connection.port2())
+            if port.outputPort and port.outputPort in ends:
+                connection.rebind(port.outputPort, self.m_outputStub)
+            if port in ends:
+                connection.rebind(port, self.m_inputStub)
+
+        if hasattr(self.m_nodeEditor, "onUnbindPort"):
+            self.m_nodeEditor.onUnbindPort(self, port, name)
+
+
+    def showPort(self, name):
+        # scrolls the port list so the port is bound
+        if name not in self.m_specIndex or name in self.m_boundPorts or self.isEditing():
+            return
+
+        # pinned ports are bound whenever the block is not collapsed
+        if name not in self.m_pinned:
+            unpinned = [spec[0] for spec in self.m_specs if spec[0] not in self.m_pinned]
+            rows = self.portPoolSize - len(self.m_pinned)
+            self.m_scrollOffset = min(unpinned.index(name), max(0, len(unpinned) - rows))
+        self.m_collapsed = False
+        self.updateSlice()
+
+
+    def isEditing(self):
+        for port in self.m_pool:
+            if port.valueEditor:
+                return True
+        return False
+
+
+    def scrollPorts(self, rows):
+        offset = max(0, min(self.maxScrollOffset(), self.m_scrollOffset + rows))
+        if offset == self.m_scrollOffset or self.isEditing():
+            return
+
+        self.m_scrollOffset = offset
+        self.updateSlice()
+
+
+    def setCollapsed(self, collapsed):
+        if collapsed == self.m_collapsed:
+            return
+
+        self.m_collapsed = collapsed
+        self.updateSlice()
+
+
+    def isCollapsed(self):
+        return self.m_collapsed
+
+
+    def setPinned(self, name, pinned):
+        if name not in self.m_specIndex or pinned == (name in self.m_pinned):
+            return False
+        if pinned:
+            # leave at least one row to scroll
+            if len(self.m_pinned) >= self.portPoolSize - 1:
+                return False
+            self.m_pinned.add(name)
+        else:
+            self.m_pinned.discard(name)
+
+        self.m_scrollOffset = min(self.m_scrollOffset, self.maxScrollOffset())
+        self.updateSlice()
+        return True
+
+
+    def isPinned(self, name):
+        return name in self.m_pinned
+
+
+    def portState(self):
+        return (self.m_collapsed, set(self.m_pinned), self.m_scrollOffset)
+
+
+    def setPortState(self, state):
+        # only before the virtual ports are added
+        (self.m_collapsed, self.m_pinned, self.m_scrollOffset) = state
+
+
+    def wheelEvent(self, event):
+        if not self.maxScrollOffset():
+            event.ignore()
+            return
+
+        self.scrollPorts(-event.delta() // 40)
+        event.accept()
+
+
+    @classmethod
+    def estimateSize(cls, font, name, portNames):
+        # the size updateLayout gives a block with a name port and value
+        # ports with these names, without creating any items
+        nameFont = QNEMetrics.styledFont(font, QNEMetrics.BoldStyle)
+        portFont = QNEMetrics.styledFont(font, QNEMetrics.PlainStyle)
+        portHeight = QNEMetrics.lineHeight(portFont)
+
+        width = QNEMetrics.textWidth(nameFont, name)
+        height = cls.VertMargin + QNEMetrics.lineHeight(nameFont)
+        count = 0
+        for portName in portNames:
+            width = max(width, QNEMetrics.textWidth(portFont, portName) + QNEPort.WidgetWidth)
+            count += 1
+
+        # at most a pool of ports is shown, with a footer below
+        height += min(count, cls.PortPoolSize) * portHeight
+        if count > cls.PortPoolSize:
+            height += portHeight
+
+        return QSizeF(width + cls.HorzMargin, height)
+
+
+    def portAt(self, scenePos):
+        for port in self.ports():
+            if port.isVisible() and port.boundingRect().contains(port.mapFromScene(scenePos)):
+                return port
+
+        return None
+
+
+    def contextMenuEvent(self, event):
+        port = self.portAt(event.scenePos())
+        if port in self.m_fixedPorts:
+            port = None
+
+        menu = QMenu()
+        historyAction = None
+        pinAction = None
+        collapseAction = None
+        if port and port.hasValue() and hasattr(self.m_nodeEditor, "setPortHistory"):
+            historyAction = menu.addAction("Show &History")
+            historyAction.setCheckable(True)
+            historyAction.setChecked(port.history is not None)
+        if port:
+            pinAction = menu.addAction("&Pin Port")
+            pinAction.setCheckable(True)
+            pinAction.setChecked(self.isPinned(port.portName()))
+        if self.m_specs:
+            collapseAction = menu.addAction("&Collapse Ports")
+            collapseAction.setCheckable(True)
+            collapseAction.setChecked(self.m_collapsed)
+        group = None
+        groupAction = None
+        if hasattr(self.m_nodeEditor, "blockGroup"):
+            group = self.m_nodeEditor.blockGroup(self)
+        if group is not None:
+            groupAction = menu.addAction("Collapse &Group %s" % group)
+
+        if menu.isEmpty():
+            event.ignore()
+            return
+
+        action = menu.exec_(event.screenPos())
+        if action is None:
+            return
+        if action == historyAction:
+            self.m_nodeEditor.setPortHistory(self, port, historyAction.isChecked())
+        elif action == pinAction:
+            self.setPinned(port.portName(), pinAction.isChecked())
+        elif action == collapseAction:
+            self.setCollapsed(collapseAction.isChecked())
+        elif action == groupAction:
+            self.m_nodeEditor.setGroupCollapsed(group, True)
+
+
+    def editNextValue(self, port):
+        ports = self.m_fixedPorts + self.m_pool
+        index = ports.index(port)
+        for next in ports[index + 1:] + ports[:index]:
+            if next.isWritable() and next.isVisible():
+                next.editValue()
+                return True
+
+        return False
+
 
-        
     def addNonePort(self, name):
         self.addPort(name, False, False)
 
@@ -173,8 +594,9 @@ class QNEBlock(QGraphicsPathItem):
         block = QNEBlock(None)
         self.scene().addItem(block)
 
-        for port_ in self.childItems():
+        for port_ in self.m_fixedPorts:
             block.addPort(port_.portName(), port_.hasInput(), port_.hasOutput(), port_.portFlags())
+        block.addVirtualPorts(self.m_specs)
 
         return block
 
@@ -192,6 +614,30 @@ class QNEBlock(QGraphicsPathItem):
         return self.Type
 
 
+    def setHighlighted(self, highlighted):
+        if highlighted != self.m_highlighted:
+            self.m_highlighted = highlighted
+            self.update()
+
+
+    def isHighlighted(self):
+        return self.m_highlighted
+
+
+    def setDetailLevel(self, level):
+        if level == self.m_detailLevel:
+            return
+
+        self.m_detailLevel = level
+        for port in self.ports():
+            port.setDetailLevel(level)
+        self.update()
+
+
+    def detailLevel(self):
+        return self.m_detailLevel
+
+
     def setName(self, name):
         self.m_name = name
 
@@ -25,13 +25,20 @@
 #SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from PySide.QtCore import (Qt, QPointF)
+from PySide.QtCore import (Qt, QPointF, QTimer)
 from PySide.QtGui import (QBrush, QPen, QPainterPath)
 from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem)
 
+from qneprofiler import QNEProfiler
+
 class QNEConnection(QGraphicsPathItem):
     (Type) = (QGraphicsItem.UserType +2)
 
+    # connections whose ports moved; they are rebuilt once per event loop
+    # iteration no matter how many of their ports moved in the meantime
+    m_dirty = set()
+    m_updateScheduled = False
+
     def __init__(self, parent):
         super(QNEConnection, self).__init__(parent)
 
@@ -45,6 +52,9 @@ class QNEConnection(QGraphicsPathItem):
         self.m_port1 = None
         self.m_port2 = None
 
+        self.m_index = None
+        self.m_key = None
+
         self.pos1 = QPointF()
         self.pos2 = QPointF()
 
@@ -55,6 +65,11 @@ class QNEConnection(QGraphicsPathItem):
 
 
     def delete(self):
+        if self.m_index:
+            self.m_index.remove(self)
+        if self.m_port1 and self.m_port2:
+            self.m_port1.removeLink(self.m_port2, self)
+            self.m_port2.removeLink(self.m_port1, self)
         if self.m_port1:
             self.m_port1.removeConnection(self)
         if self.m_port2:
@@ -65,11 +80,13 @@ class QNEConnection(QGraphicsPathItem):
         self.m_port2 = None
 
 
+    @QNEProfiler.timed("QNEConnection.paint")
     def paint(self, painter, option, widget):
         if self.isSelected():
             painter.setPen(self.selectedPen)
         else:
             painter.setPen(self.normalPen)
+        painter.setBrush(Qt.NoBrush)
 
         painter.drawPath(self.path())
 
@@ -85,11 +102,37 @@ class QNEConnection(QGraphicsPathItem):
     def setPort1(self, port):
         self.m_port1 = port
         self.m_port1.addConnection(self)
+        self.link()
 
 
     def setPort2(self, port):
         self.m_port2 = port
         self.m_port2.addConnection(self)
+        self.link()
+
+
+    def rebind(self, old, new):
+        # moves the end at old to new, e.g. between a port and the stub of
+        # its block when the port is no longer shown
+        if self.m_port1 and self.m_port2:
+            self.m_port1.removeLink(self.m_port2, self)
+            self.m_port2.removeLink(self.m_port1, self)
+
+        old.removeConnection(self)
+        if self.m_port1 is old:
+            self.m_port1 = new
+        else:
+            self.m_port2 = new
+        new.addConnection(self)
+
+        self.link()
+        self.markDirty()
+
+
+    def link(self):
+        if self.m_port1 and self.m_port2:
+            self.m_port1.addLink(self.m_port2, self)
+            self.m_port2.addLink(self.m_port1, self)
 
 
     def updatePosFromPorts(self):
@@ -97,17 +140,55 @@ class QNEConnection(QGraphicsPathItem):
         self.pos2 = self.m_port2.scenePos()+QPointF(self.m_port2.radius(),0)
 
 
+    def markDirty(self):
+        QNEConnection.m_dirty.add(self)
+        if not QNEConnection.m_updateScheduled:
+            QNEConnection.m_updateScheduled = True
+            QTimer.singleShot(0, QNEConnection.updateDirty)
+
+
+    @staticmethod
+    @QNEProfiler.timed("QNEConnection.updateDirty")
+    def updateDirty():
+        QNEConnection.m_updateScheduled = False
+        dirty = QNEConnection.m_dirty
+        QNEConnection.m_dirty = set()
+
+        for connection in dirty:
+            if connection.m_port1 and connection.m_port2:
+                connection.updateFromPorts()
+
+
+    def updateFromPorts(self):
+        pos1 = self.pos1
+        pos2 = self.pos2
+        self.updatePosFromPorts()
+
+        delta = self.pos1 - pos1
+        if (self.pos2 - pos2 - delta).manhattanLength() < 0.01 and not self.path().isEmpty():
+            # both ends moved together, so the curve keeps its shape
+            self.setPos(self.pos() + delta)
+        else:
+            self.updatePath()
+
+
     def updatePath(self):
+        # the path is relative to the item position, which changes when the
+        # connection is translated as a whole
+        origin = self.pos()
+        pos1 = self.pos1 - origin
+        pos2 = self.pos2 - origin
+
         path = QPainterPath()
-        path.moveTo(self.pos1)
+        path.moveTo(pos1)
 
-        dx = self.pos2.x() - self.pos1.x()
-        dy = self.pos2.y() - self.pos1.y()
+        dx = pos2.x() - pos1.x()
+        dy = pos2.y() - pos1.y()
 
-        ctr1 = QPointF(self.pos1.x() + dx * 0.25, self.pos1.y() + dy * 0.1)
-        ctr2 = QPointF(self.pos1.x() + dx * 0.75, self.pos1.y() + dy * 0.9)
+        ctr1 = QPointF(pos1.x() + dx * 0.25, pos1.y() + dy * 0.1)
+        ctr2 = QPointF(pos1.x() + dx * 0.75, pos1.y() + dy * 0.9)
 
-        path.cubicTo(ctr1, ctr2, self.pos2)
+        path.cubicTo(ctr1, ctr2, pos2)
         self.setPath(path)
 
 
@@ -122,3 +203,93 @@ class QNEConnection(QGraphicsPathItem):
     def port2(self):
         return self.m_port2
 
+
+    def key(self):
+        return self.m_key
+
+
+class QNEConnectionIndex(object):
+    # Registry of complete connections keyed by
+    # (emit peer, emitter, recv peer, receiver), with adjacency sets per
+    # emitting and per receiving port
+
+    def __init__(self):
+        self.m_connections = {}
+        self.m_emitters = {}
+        self.m_receivers = {}
+
+
+    @staticmethod
+    def peerKey(block):
+        uuid = block.uuid()
+        return getattr(uuid, "hex", uuid)
+
+
+    @staticmethod
+    def keyFor(port1, port2):
+        if not port1.isOutput():
+            (port1, port2) = (port2, port1)
+
+        return (QNEConnectionIndex.peerKey(port1.block()), port1.portName(),
+            QNEConnectionIndex.peerKey(port2.block()), port2.portName())
+
+
+    def add(self, connection, key = None):
+        # the key is needed for connections that end at a stub
+        if key is None:
+            key = self.keyFor(connection.port1(), connection.port2())
+        if key in self.m_connections:
+            return None
+
+        self.m_connections[key] = connection
+        connection.m_index = self
+        connection.m_key = key
+
+        (emitPeer, emitter, recvPeer, receiver) = key
+        self.m_emitters.setdefault((emitPeer, emitter), set()).add((recvPeer, receiver))
+        self.m_receivers.setdefault((recvPeer, receiver), set()).add((emitPeer, emitter))
+
+        return key
+
+
+    def remove(self, connection):
+        key = connection.m_key
+        if self.m_connections.get(key) is not connection:
+            return
+
+        self.m_connections.pop(key)
+        connection.m_index = None
+        connection.m_key = None
+
+        (emitPeer, emitter, recvPeer, receiver) = key
+        self.discard(self.m_emitters, (emitPeer, emitter), (recvPeer, receiver))
+        self.discard(self.m_receivers, (recvPeer, receiver), (emitPeer, emitter))
+
+
+    def discard(self, adjacency, key, value):
+        values = adjacency.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                adjacency.pop(key)
+
+
+    def connection(self, emitPeer, emitter, recvPeer, receiver):
+        return self.m_connections.get((emitPeer, emitter, recvPeer, receiver))
+
+
+    def subscribers(self, emitPeer, emitter):
+        return set(self.m_emitters.get((emitPeer, emitter), ()))
+
+
+    def emitters(self, recvPeer, receiver):
+        return set(self.m_receivers.get((recvPeer, receiver), ()))
+
+
+    def __contains__(self, key):
+        return key in self.m_connections
+
+
+    def __len__(self):
+        return len(self.m_connections)
+
@@ -0,0 +1,151 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import math
+
+from PySide.QtCore import (Qt, QPointF, QRectF)
+from PySide.QtGui import (QBrush, QPen, QPainterPath)
+from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem, QMenu)
+
+from qneblock import QNEBlock
+from qneport import QNEPort
+from qneprofiler import QNEProfiler
+
+class QNEGroupBlock(QNEBlock):
+    # Stands in for the peers of a collapsed group
+    (Type) = (QGraphicsItem.UserType +5)
+
+    def __init__(self, parent):
+        super(QNEGroupBlock, self).__init__(parent)
+
+        self.setFlag(QGraphicsItem.ItemIsMovable, False)
+        self.m_memberCount = 0
+        self.m_countPort = None
+
+
+    def type(self):
+        return self.Type
+
+
+    def setGroup(self, name, memberCount):
+        if not self.m_fixedPorts:
+            self.addPort(name, False, False, QNEPort.NamePort)
+            self.m_countPort = self.addPort("", False, False, QNEPort.TypePort)
+        self.setName(name)
+
+        if memberCount != self.m_memberCount:
+            self.m_memberCount = memberCount
+            self.m_countPort.setName("%d peers" % memberCount)
+            self.updateLayout()
+
+
+    def memberCount(self):
+        return self.m_memberCount
+
+
+    def mouseDoubleClickEvent(self, event):
+        if hasattr(self.m_nodeEditor, "setGroupCollapsed"):
+            self.m_nodeEditor.setGroupCollapsed(self.m_name, False)
+
+
+    def contextMenuEvent(self, event):
+        if not hasattr(self.m_nodeEditor, "setGroupCollapsed"):
+            event.ignore()
+            return
+
+        menu = QMenu()
+        expandAction = menu.addAction("&Expand Group")
+        if menu.exec_(event.screenPos()) == expandAction:
+            self.m_nodeEditor.setGroupCollapsed(self.m_name, False)
+
+
+class QNEBundle(QGraphicsPathItem):
+    # A single edge for all subscriptions between two items, of which at
+    # least one is a collapsed group
+    (Type) = (QGraphicsItem.UserType +6)
+
+    def __init__(self, parent):
+        super(QNEBundle, self).__init__(parent)
+
+        self.color = QApplication.palette().text().color()
+        self.setBrush(QBrush(Qt.NoBrush))
+        self.setZValue(-1)
+
+        self.m_count = 0
+        self.m_label = ""
+        self.m_labelPos = QPointF()
+
+
+    def type(self):
+        return self.Type
+
+
+    def setEnds(self, item1, item2, count):
+        self.prepareGeometryChange()
+        rect1 = item1.sceneBoundingRect()
+        rect2 = item2.sceneBoundingRect()
+        if rect1.center().x() > rect2.center().x():
+            (rect1, rect2) = (rect2, rect1)
+
+        pos1 = QPointF(rect1.right(), rect1.center().y())
+        pos2 = QPointF(rect2.left(), rect2.center().y())
+        dx = pos2.x() - pos1.x()
+        dy = pos2.y() - pos1.y()
+
+        path = QPainterPath()
+        path.moveTo(pos1)
+        path.cubicTo(QPointF(pos1.x() + dx * 0.25, pos1.y() + dy * 0.1),
+                     QPointF(pos1.x() + dx * 0.75, pos1.y() + dy * 0.9), pos2)
+        self.setPath(path)
+
+        if count != self.m_count:
+            self.m_count = count
+            self.m_label = str(count)
+            # thicker for more subscriptions, but not without bound
+            self.setPen(QPen(self.color, min(8, 2 + math.log(count, 2))))
+        self.m_labelPos = (pos1 + pos2) / 2
+
+
+    def count(self):
+        return self.m_count
+
+
+    def boundingRect(self):
+        rect = super(QNEBundle, self).boundingRect()
+        return rect.united(QRectF(self.m_labelPos - QPointF(20, 10), self.m_labelPos + QPointF(20, 10)))
+
+
+    @QNEProfiler.timed("QNEBundle.paint")
+    def paint(self, painter, option, widget):
+        painter.setPen(self.pen())
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPath(self.path())
+
+        rect = QRectF(self.m_labelPos - QPointF(20, 10), self.m_labelPos + QPointF(20, 10))
+        painter.setPen(QPen(self.color, 1))
+        painter.setBrush(QApplication.palette().window())
+        painter.drawRoundedRect(rect, 5, 5)
+        painter.drawText(rect, Qt.AlignCenter, self.m_label)
@@ -0,0 +1,89 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from PySide.QtGui import (QFont, QFontMetrics)
+
+class QNEMetrics(object):
+    (PlainStyle, BoldStyle, ItalicStyle) = (0, 1, 2)
+
+    # Process-wide cache of styled fonts, font metrics and measured text
+    # widths, keyed by QFont.key(). Call invalidate() when the scene font
+    # changes.
+    m_fonts = {}
+    m_metrics = {}
+    m_widths = {}
+    maxWidths = 20000
+
+
+    @classmethod
+    def invalidate(cls):
+        cls.m_fonts = {}
+        cls.m_metrics = {}
+        cls.m_widths = {}
+
+
+    @classmethod
+    def styledFont(cls, font, style):
+        key = (font.key(), style)
+        styledFont = cls.m_fonts.get(key)
+        if styledFont is None:
+            styledFont = QFont(font)
+            if style == cls.BoldStyle:
+                styledFont.setBold(True)
+            elif style == cls.ItalicStyle:
+                styledFont.setItalic(True)
+            cls.m_fonts[key] = styledFont
+
+        return styledFont
+
+
+    @classmethod
+    def fontMetrics(cls, font):
+        key = font.key()
+        metrics = cls.m_metrics.get(key)
+        if metrics is None:
+            metrics = QFontMetrics(font)
+            cls.m_metrics[key] = metrics
+
+        return metrics
+
+
+    @classmethod
+    def lineHeight(cls, font):
+        return cls.fontMetrics(font).height()
+
+
+    @classmethod
+    def textWidth(cls, font, text):
+        key = (font.key(), text)
+        width = cls.m_widths.get(key)
+        if width is None:
+            if len(cls.m_widths) >= cls.maxWidths:
+                cls.m_widths = {}
+            width = cls.fontMetrics(font).width(text)
+            cls.m_widths[key] = width
+
+        return width
@@ -25,41 +25,78 @@
 #SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from PySide.QtCore import (Qt, QSize)
+from PySide.QtCore import (Qt, QSize, QPointF, QRectF)
 from PySide.QtGui import (QBrush, QColor, QPainter, QPainterPath, QPen,
-    QFontMetrics)
-from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem, 
-    QGraphicsTextItem)
+    QPolygonF, QStaticText)
+from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem)
 
 from qnevalue import QNEValue
+from qnemetrics import QNEMetrics
+from qneprofiler import QNEProfiler
 
 class QNEPort(QGraphicsPathItem):
     (NamePort, TypePort) = (1, 2)
+    (FullDetail, LabelDetail, PortDetail, OutlineDetail) = (0, 1, 2, 3)
+    (WidgetWidth) = (50)
+    (ExternalLength) = (16)
     (Type) = (QGraphicsItem.UserType +1)
 
     def __init__(self, parent):
         super(QNEPort, self).__init__(parent)
 
-        self.label = QGraphicsTextItem(self)
         self.radius_ = 4
         self.margin = 3
-        self.widgetWidth = 50
+        self.textMargin = 4
+        self.widgetWidth = self.WidgetWidth
+        self.m_width = 0
 
         self.setPen(QPen(QApplication.palette().text().color(), 1))
         self.setBrush(QApplication.palette().highlight())
         self.setFlag(QGraphicsItem.ItemSendsScenePositionChanges)
-        
-        self.valueText = QNEValue(self)
-        self.valueText.setPort(self)
 
-        self.outputPort = QNEOutputPort(self)
+        # label and value are painted by the port itself; an editable text
+        # item only exists while a writable value is being edited
+        self.name = ""
+        self.value = ""
+        self.textPen = QPen(QApplication.palette().text().color())
+        self.labelText = QStaticText()
+        self.labelText.setPerformanceHint(QStaticText.AggressiveCaching)
+        self.valueText = QStaticText()
+        self.valueText.setPerformanceHint(QStaticText.AggressiveCaching)
+        self.valueDisplay = ""
+        self.valueEditor = None
+        self.labelFont_ = QApplication.font()
+        self.valueFont_ = QApplication.font()
+        self.labelPos = QPointF()
+        self.valuePos = QPointF()
+        self.textRect = QRectF()
+
+        self.readable = True
+        self.writable = False
+        self.showLabel = True
+        self.showValue = True
+        self.valueStale = False
+
+        # recent samples of the value, drawn as a sparkline behind it
+        self.history = None
+
+        # connections to and from peers without a block, drawn as short
+        # dashed lines off the port
+        self.m_externalInputs = 0
+        self.m_externalOutputs = 0
+        self.externalPen = QPen(QApplication.palette().text().color(), 1, Qt.DashLine)
+
+        # only created for ports that emit
+        self.outputPort = None
 
         self.m_portFlags = 0
         self.hasInput_ = False
         self.hasOutput_ = False
 
         self.m_block = None
-        self.m_connections = []
+        self.m_connections = set()
+        # other endpoints of complete connections, for O(1) isConnected
+        self.m_links = {}
 
 
     def __del__(self):
@@ -68,27 +105,199 @@ class QNEPort(QGraphicsPathItem):
 
 
     def delete(self):
-        for connection in self.m_connections:
+        for connection in list(self.m_connections):
             connection.delete()
         if self.scene():
             self.scene().removeItem(self)
         self.m_block = None
-        self.m_connections = []
+        self.m_connections = set()
+        self.m_links = {}
+
+
+    @QNEProfiler.timed("QNEPort.paint")
+    def paint(self, painter, option, widget):
+        if self.hasInput_:
+            painter.setPen(self.pen())
+            painter.setBrush(self.brush())
+            painter.drawPath(self.path())
+
+        if self.m_externalInputs or self.m_externalOutputs:
+            painter.setPen(self.externalPen)
+            if self.m_externalInputs:
+                painter.drawLine(QPointF(0, 0), QPointF(-self.ExternalLength, 0))
+            if self.m_externalOutputs:
+                x = self.m_width + 2*self.radius_
+                painter.drawLine(QPointF(x, 0), QPointF(x + self.ExternalLength, 0))
+
+        painter.setPen(self.textPen)
+        if self.showLabel:
+            painter.setFont(self.labelFont_)
+            painter.drawStaticText(self.labelPos, self.labelText)
+
+        if self.hasValue() and self.showValue and not self.valueEditor:
+            if self.history is not None and self.history.count > 1:
+                self.paintHistory(painter)
+                painter.setPen(self.textPen)
+            painter.setFont(self.valueFont_)
+            painter.drawStaticText(self.valuePos, self.valueText)
+
+
+    def paintHistory(self, painter):
+        history = self.history
+        rect = self.valueRect().adjusted(1, 1, -1, -1)
+        (low, high) = history.range()
+        span = (high - low) or 1.0
+
+        # at most one sample per pixel is drawn
+        step = max(1, history.count // max(1, int(rect.width())))
+        color = QColor(QApplication.palette().highlight().color())
+        hue = max(0, color.hue())
+        for channel in range(history.channels):
+            values = history.values(channel)[::step]
+            dx = rect.width() / max(1, len(values) - 1)
+            points = QPolygonF()
+            for (i, value) in enumerate(values):
+                points.append(QPointF(rect.left() + i * dx,
+                                      rect.bottom() - (value - low) / span * rect.height()))
+            # vector components get distinct hues
+            color.setHsv((hue + 90 * channel) % 360, color.saturation(), color.value(), 160)
+            painter.setPen(QPen(color, 0))
+            painter.drawPolyline(points)
+
+
+    def boundingRect(self):
+        rect = super(QNEPort, self).boundingRect().united(self.textRect)
+        if self.m_externalInputs:
+            rect = rect.united(QRectF(-self.ExternalLength, -1, self.ExternalLength, 2))
+        if self.m_externalOutputs:
+            rect = rect.united(QRectF(self.m_width + 2*self.radius_, -1, self.ExternalLength, 2))
+        return rect
+
+
+    def setExternalConnections(self, inputs, outputs):
+        # the number of connections whose other end has no block
+        if (inputs, outputs) == (self.m_externalInputs, self.m_externalOutputs):
+            return
+
+        self.prepareGeometryChange()
+        self.m_externalInputs = inputs
+        self.m_externalOutputs = outputs
+        if inputs or outputs:
+            self.setToolTip("%d incoming and %d outgoing connections to peers that are not shown" %
+                (inputs, outputs))
+        else:
+            self.setToolTip("")
+        self.update()
+
+
+    def updateGeometry(self):
+        if not self.scene():
+            return
+
+        self.labelFont_ = self.labelFont()
+        self.valueFont_ = self.scene().font()
+        height = QNEMetrics.lineHeight(self.labelFont_)
+
+        self.prepareGeometryChange()
+        self.textRect = QRectF(0, -height/2, max(self.m_width, 2*self.radius_), height)
+        self.labelPos = QPointF(self.radius_ + self.margin + self.textMargin, -height/2)
+        self.valuePos = QPointF(self.m_width - self.widgetWidth - self.radius_ - self.margin + self.textMargin,
+                                -height/2)
 
 
     def setName(self, name):
         self.name = name
-        self.label.setPlainText(name)
-        self.label.setPos(self.radius_ + self.margin, -self.label.boundingRect().height()/2)
+        self.labelText.setText(name)
+        self.updateGeometry()
 
 
     def setValue(self, value):
         self.value = value
-        self.valueText.showValue(value)
+        if self.valueEditor:
+            # shown once editing is done
+            return
+
+        if self.hasValue() and self.showValue:
+            self.updateValueText()
+        else:
+            self.valueStale = True
+
+
+    def updateValueText(self):
+        self.valueStale = False
+
+        value = self.value
+        if len(value) > 9:
+            value = value[:6] + "..."
+        if value != self.valueDisplay:
+            self.valueDisplay = value
+            self.valueText.setText(value)
+            self.update(self.valueRect())
+
+
+    def setHistory(self, history):
+        self.history = history
+        self.update(self.valueRect())
+
+
+    def updateHistory(self):
+        if self.history is not None and self.showValue:
+            self.update(self.valueRect())
+
+
+    def hasValue(self):
+        return self.readable and not self.m_portFlags
 
 
     def setAccess(self, access):
-        self.valueText.setAccess(access)
+        self.readable = 'r' in access
+        self.writable = 'w' in access
+        if self.hasValue() and self.showValue and self.valueStale:
+            self.updateValueText()
+        self.update()
+
+
+    def isWritable(self):
+        return self.writable and self.hasValue()
+
+
+    def valueRect(self):
+        return QRectF(self.valuePos.x() - self.textMargin, self.textRect.top(),
+                      self.widgetWidth, self.textRect.height())
+
+
+    def isValueAt(self, scenePos):
+        return self.valueRect().contains(self.mapFromScene(scenePos))
+
+
+    def editValue(self):
+        if not self.isWritable() or not self.showValue:
+            return
+
+        if not self.valueEditor:
+            self.valueEditor = QNEValue(self)
+            self.valueEditor.setPort(self)
+            self.valueEditor.setFont(self.valueFont_)
+            self.valueEditor.setPos(self.valuePos.x() - self.textMargin,
+                                    -self.valueEditor.boundingRect().height()/2)
+            self.setZValue(1)
+            self.update()
+
+        self.valueEditor.edit(self.value)
+
+
+    def closeEditor(self):
+        if not self.valueEditor:
+            return
+
+        # called from the editor's own focus handling, so it is deleted
+        # once control returns to the event loop
+        self.valueEditor.deleteLater()
+        self.valueEditor = None
+        self.setZValue(0)
+        self.valueDisplay = None
+        self.setValue(self.value)
+        self.update()
 
 
     def setCanConnect(self, hasInput, hasOutput):
@@ -96,8 +305,11 @@ class QNEPort(QGraphicsPathItem):
         self.hasOutput_ = hasOutput
 
         if self.hasOutput_:
+            if not self.outputPort:
+                self.outputPort = QNEOutputPort(self)
+                self.outputPort.setPos(self.m_width, 0)
             self.outputPort.setVisible(True)
-        else:
+        elif self.outputPort:
             self.outputPort.setVisible(False)
 
         path = QPainterPath()
@@ -109,11 +321,12 @@ class QNEPort(QGraphicsPathItem):
 
 
     def setWidth(self, width):
-        self.outputPort.setPos(width, 0)
-        self.valueText.setPos(width - self.widgetWidth - self.radius_ - self.margin,
-                              -self.valueText.boundingRect().height()/2)
+        self.m_width = width
+        if self.outputPort:
+            self.outputPort.setPos(width, 0)
+        self.updateGeometry()
+
 
-        
     def setNEBlock(self, block):
         self.m_block = block
 
@@ -121,24 +334,36 @@ class QNEPort(QGraphicsPathItem):
     def setPortFlags(self, flags):
         self.m_portFlags = flags
 
-        if self.m_portFlags & self.TypePort:
-            font = self.scene().font()
-            font.setItalic(True)
-            self.label.setFont(font)
-            self.valueText.setVisible(False)
+        if self.m_portFlags & (self.TypePort | self.NamePort):
             self.setPath(QPainterPath())
+        self.updateGeometry()
+
+
+    def setDetailLevel(self, level):
+        self.setVisible(level <= self.PortDetail)
+        self.showLabel = level <= self.LabelDetail
+        self.showValue = level == self.FullDetail
+        if self.showValue and self.valueStale:
+            self.updateValueText()
+        self.update()
+
+
+    def labelStyle(self):
+        if self.m_portFlags & self.TypePort:
+            return QNEMetrics.ItalicStyle
         elif self.m_portFlags & self.NamePort:
-            font = self.scene().font()
-            font.setBold(True)
-            self.label.setFont(font)
-            self.valueText.setVisible(False)
-            self.setPath(QPainterPath())
+            return QNEMetrics.BoldStyle
+        return QNEMetrics.PlainStyle
+
+
+    def labelFont(self):
+        return QNEMetrics.styledFont(self.scene().font(), self.labelStyle())
 
 
     def innerSize(self):
-        fontmetrics = QFontMetrics(self.scene().font())
-        height = fontmetrics.height()
-        width = fontmetrics.width(self.name)
+        font = self.labelFont()
+        height = QNEMetrics.lineHeight(font)
+        width = QNEMetrics.textWidth(font, self.name)
 
         if self.m_portFlags == 0:
             width = width + self.widgetWidth
@@ -183,32 +408,38 @@ class QNEPort(QGraphicsPathItem):
 	
 
     def addConnection(self, connection):
-        self.m_connections.append(connection)
+        self.m_connections.add(connection)
 
 
     def removeConnection(self, connection):
-        try:
-            self.m_connections.remove(connection)
-        except: pass
+        self.m_connections.discard(connection)
+
+
+    def addLink(self, other, connection):
+        if other not in self.m_links:
+            self.m_links[other] = set()
+        self.m_links[other].add(connection)
+
+
+    def removeLink(self, other, connection):
+        if other in self.m_links:
+            self.m_links[other].discard(connection)
+            if not self.m_links[other]:
+                self.m_links.pop(other)
 
 
     def connections(self):
-        return self.m_connections
+        return list(self.m_connections)
 
 
     def isConnected(self, other):
-        for connection in self.m_connections:
-            if connection.port1() == other or connection.port2() == other:
-                return True
-
-        return False
+        return other in self.m_links
 
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.ItemScenePositionHasChanged:
             for connection in self.m_connections:
-                connection.updatePosFromPorts()
-                connection.updatePath()
+                connection.markDirty()
 
         return value
 
@@ -242,6 +473,14 @@ class QNEOutputPort(QGraphicsPathItem):
         self.parent.removeConnection(connection)
 
 
+    def addLink(self, other, connection):
+        self.parent.addLink(other, connection)
+
+
+    def removeLink(self, other, connection):
+        self.parent.removeLink(other, connection)
+
+
     def isInput(self):
         return False
 
@@ -272,3 +511,99 @@ class QNEOutputPort(QGraphicsPathItem):
 
     def portName(self):
         return self.parent.portName()
+
+
+class QNEPortStub(QGraphicsPathItem):
+    # Block edge end point for the connections of ports that are not shown,
+    # because the port list is collapsed or scrolled
+    (Type) = (QGraphicsItem.UserType +7)
+
+    def __init__(self, parent, isOutput):
+        super(QNEPortStub, self).__init__(parent)
+
+        self.m_block = parent
+        self.m_isOutput = isOutput
+        self.radius_ = 4
+        self.m_connections = set()
+        self.m_links = {}
+
+        self.setPen(QPen(QApplication.palette().text().color(), 1))
+        self.setBrush(QBrush(Qt.NoBrush))
+        self.setFlag(QGraphicsItem.ItemSendsScenePositionChanges)
+
+        path = QPainterPath()
+        path.addEllipse(0, -self.radius_, 2*self.radius_, 2*self.radius_)
+        self.setPath(path)
+        self.setVisible(False)
+
+
+    def delete(self):
+        for connection in list(self.m_connections):
+            connection.delete()
+        if self.scene():
+            self.scene().removeItem(self)
+        self.m_connections = set()
+        self.m_links = {}
+
+
+    def type(self):
+        return self.Type
+
+
+    def addConnection(self, connection):
+        self.m_connections.add(connection)
+        self.setVisible(True)
+
+
+    def removeConnection(self, connection):
+        self.m_connections.discard(connection)
+        self.setVisible(bool(self.m_connections))
+
+
+    def addLink(self, other, connection):
+        if other not in self.m_links:
+            self.m_links[other] = set()
+        self.m_links[other].add(connection)
+
+
+    def removeLink(self, other, connection):
+        if other in self.m_links:
+            self.m_links[other].discard(connection)
+            if not self.m_links[other]:
+                self.m_links.pop(other)
+
+
+    def connections(self):
+        return list(self.m_connections)
+
+
+    def isConnected(self, other):
+        return other in self.m_links
+
+
+    def isInput(self):
+        return not self.m_isOutput
+
+
+    def isOutput(self):
+        return self.m_isOutput
+
+
+    def block(self):
+        return self.m_block
+
+
+    def radius(self):
+        return self.radius_
+
+
+    def portName(self):
+        return ""
+
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItem.ItemScenePositionHasChanged:
+            for connection in self.m_connections:
+                connection.markDirty()
+
+        return value
@@ -0,0 +1,128 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import functools
+import json
+import time
+from collections import deque
+
+class QNEProfiler(object):
+    # Process-wide timing of hot paths. Functions decorated with timed()
+    # record their duration while profiling is enabled; the last
+    # windowSize samples per name are kept for the percentiles.
+    enabled = False
+    windowSize = 1000
+
+    m_samples = {}
+    m_counts = {}
+
+
+    @classmethod
+    def setEnabled(cls, enabled):
+        cls.enabled = enabled
+
+
+    @classmethod
+    def reset(cls):
+        cls.m_samples = {}
+        cls.m_counts = {}
+
+
+    @classmethod
+    def record(cls, name, duration):
+        samples = cls.m_samples.get(name)
+        if samples is None:
+            samples = deque(maxlen=cls.windowSize)
+            cls.m_samples[name] = samples
+            cls.m_counts[name] = 0
+        samples.append(duration)
+        cls.m_counts[name] += 1
+
+
+    @classmethod
+    def timed(cls, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return function(*args, **kwargs)
+
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    cls.record(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+
+    @classmethod
+    def statistics(cls):
+        # durations in milliseconds, over the rolling window
+        statistics = {}
+        for (name, samples) in list(cls.m_samples.items()):
+            samples = sorted(samples)
+            if not samples:
+                continue
+            last = len(samples) - 1
+            statistics[name] = {
+                "count": cls.m_counts[name],
+                "mean": 1000 * sum(samples) / len(samples),
+                "p50": 1000 * samples[int(0.50 * last)],
+                "p95": 1000 * samples[int(0.95 * last)],
+                "p99": 1000 * samples[int(0.99 * last)],
+                "max": 1000 * samples[last],
+            }
+
+        return statistics
+
+
+    @classmethod
+    def report(cls):
+        lines = ["%-32s %8s %7s %7s %7s" % ("ms", "count", "p50", "p95", "p99")]
+        statistics = cls.statistics()
+        for name in sorted(statistics):
+            entry = statistics[name]
+            lines.append("%-32s %8d %7.2f %7.2f %7.2f" %
+                (name, entry["count"], entry["p50"], entry["p95"], entry["p99"]))
+
+        return "\n".join(lines)
+
+
+    @classmethod
+    def export(cls, fileName, extra = None):
+        data = {
+            "timestamp": time.time(),
+            "windowSize": cls.windowSize,
+            "timings": cls.statistics(),
+        }
+        if extra:
+            data.update(extra)
+
+        with open(fileName, "w") as output:
+            json.dump(data, output, indent=2, sort_keys=True)
@@ -0,0 +1,204 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from PySide.QtCore import (Qt, QRect)
+from PySide.QtGui import (QColor, QImage, QPainter, QPixmap)
+
+class QNEShadow(object):
+    (NoShadow, EffectShadow, CachedShadow) = (0, 1, 2)
+
+    # Shared settings for block drop shadows. In CachedShadow mode a single
+    # pre-blurred rounded rect is sliced into nine parts and stretched to
+    # the size of a block; the result is cached per block size.
+    mode = CachedShadow
+    blurRadius = 8
+    cornerRadius = 5
+    offset = 2
+    color = QColor(63, 63, 63, 180)
+
+    # shadows are turned off above this number of blocks or below this
+    # scale; None disables the limit
+    maxBlocks = 300
+    minScale = 0.5
+
+    m_blockCount = 0
+    m_scale = 1
+    m_active = True
+    m_tile = None
+    m_pixmaps = {}
+    maxPixmaps = 500
+
+
+    @classmethod
+    def setMode(cls, mode):
+        cls.mode = mode
+        cls.updateActive()
+
+
+    @classmethod
+    def setBlockCount(cls, count):
+        cls.m_blockCount = count
+        return cls.updateActive()
+
+
+    @classmethod
+    def setScale(cls, scale):
+        cls.m_scale = scale
+        return cls.updateActive()
+
+
+    @classmethod
+    def updateActive(cls):
+        active = (cls.mode != cls.NoShadow and
+            (cls.maxBlocks is None or cls.m_blockCount <= cls.maxBlocks) and
+            (cls.minScale is None or cls.m_scale >= cls.minScale))
+
+        changed = active != cls.m_active
+        cls.m_active = active
+        return changed
+
+
+    @classmethod
+    def isActive(cls, mode):
+        return cls.m_active and cls.mode == mode
+
+
+    @classmethod
+    def margin(cls):
+        return cls.blurRadius + cls.offset
+
+
+    @classmethod
+    def invalidate(cls):
+        cls.m_tile = None
+        cls.m_pixmaps = {}
+
+
+    @classmethod
+    def paint(cls, painter, rect):
+        width = int(rect.width())
+        height = int(rect.height())
+        pixmap = cls.m_pixmaps.get((width, height))
+        if pixmap is None:
+            if len(cls.m_pixmaps) >= cls.maxPixmaps:
+                cls.m_pixmaps = {}
+            pixmap = cls.createPixmap(width, height)
+            cls.m_pixmaps[(width, height)] = pixmap
+
+        painter.drawPixmap(rect.x() - cls.blurRadius + cls.offset,
+            rect.y() - cls.blurRadius + cls.offset, pixmap)
+
+
+    @classmethod
+    def createPixmap(cls, width, height):
+        blur = cls.blurRadius
+        tile = cls.tile()
+        slice_ = 2 * blur + cls.cornerRadius
+        size = tile.width()
+
+        width += 2 * blur
+        height += 2 * blur
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
+        if width < 2 * slice_ or height < 2 * slice_:
+            painter.drawPixmap(QRect(0, 0, width, height), tile)
+        else:
+            # corners keep their size, edges and center are stretched
+            columns = [(0, slice_, 0, slice_),
+                (slice_, width - 2 * slice_, slice_, size - 2 * slice_),
+                (width - slice_, slice_, size - slice_, slice_)]
+            rows = [(0, slice_, 0, slice_),
+                (slice_, height - 2 * slice_, slice_, size - 2 * slice_),
+                (height - slice_, slice_, size - slice_, slice_)]
+            for (x, w, sx, sw) in columns:
+                for (y, h, sy, sh) in rows:
+                    painter.drawPixmap(QRect(x, y, w, h), tile, QRect(sx, sy, sw, sh))
+        painter.end()
+
+        return pixmap
+
+
+    @classmethod
+    def tile(cls):
+        if cls.m_tile is None:
+            cls.m_tile = cls.createTile()
+
+        return cls.m_tile
+
+
+    @classmethod
+    def createTile(cls):
+        blur = cls.blurRadius
+        size = 2 * (2 * blur + cls.cornerRadius) + 1
+
+        image = QImage(size, size, QImage.Format_ARGB32)
+        image.fill(0)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0))
+        painter.drawRoundedRect(blur, blur, size - 2 * blur, size - 2 * blur,
+            cls.cornerRadius, cls.cornerRadius)
+        painter.end()
+
+        alpha = [[(image.pixel(x, y) >> 24) & 0xff for x in range(size)]
+            for y in range(size)]
+
+        # three box blurs approximate a gaussian blur
+        radius = max(1, blur // 3)
+        for i in range(3):
+            alpha = cls.transpose(cls.boxBlur(alpha, radius))
+            alpha = cls.transpose(cls.boxBlur(alpha, radius))
+
+        rgb = cls.color.rgb() & 0xffffff
+        opacity = cls.color.alpha()
+        for y in range(size):
+            for x in range(size):
+                image.setPixel(x, y, ((alpha[y][x] * opacity // 255) << 24) | rgb)
+
+        return QPixmap.fromImage(image)
+
+
+    @classmethod
+    def boxBlur(cls, rows, radius):
+        result = []
+        for row in rows:
+            size = len(row)
+            blurred = []
+            for x in range(size):
+                left = max(0, x - radius)
+                right = min(size, x + radius + 1)
+                blurred.append(sum(row[left:right]) // (2 * radius + 1))
+            result.append(blurred)
+
+        return result
+
+
+    @classmethod
+    def transpose(cls, rows):
+        return [list(column) for column in zip(*rows)]
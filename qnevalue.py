@@ -26,11 +26,14 @@
 
 from PySide.QtCore import (Qt, QSize)
 from PySide.QtGui import (QBrush, QColor, QPainter, QPainterPath, QPen,
-    QFontMetrics)
+    QTextCursor)
 from PySide.QtGui import (QApplication, QGraphicsItem, QGraphicsPathItem, 
     QGraphicsTextItem)
 
 class QNEValue(QGraphicsTextItem):
+    # Editor for a writable port value. Ports paint their values
+    # themselves; QNEPort.editValue creates one of these on demand and
+    # QNEPort.closeEditor disposes of it when editing is done.
     (Type) = (QGraphicsItem.UserType +4)
 
     def __init__(self, parent):
@@ -39,9 +42,11 @@ class QNEValue(QGraphicsTextItem):
 
         self.setTextWidth(-1)
         self.setZValue(1)
+        self.setTextInteractionFlags(Qt.TextEditorInteraction)
 
         self.port = None
         self.value = None
+        self.closed = False
 
         self.background = QApplication.palette().light().color()
 
@@ -61,52 +66,43 @@ class QNEValue(QGraphicsTextItem):
         self.port = port
 
 
-    def setAccess(self, access):
-        if 'r' in access:
-            self.setVisible(True)
-        else:
-            self.setVisible(False)
+    def port(self):
+        return self.port
 
-        if 'w' in access:
-            self.setTabChangesFocus(True)
-            self.setTextInteractionFlags(Qt.TextEditorInteraction)
-        else:
-            self.setTabChangesFocus(False)
-            self.setTextInteractionFlags(Qt.NoTextInteraction)
 
+    def edit(self, value):
+        self.value = value
+        self.setPlainText(value)
 
-    def port(self):
-        return self.port
+        cursor = self.textCursor()
+        cursor.select(QTextCursor.Document)
+        self.setTextCursor(cursor)
+        self.setFocus()
 
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Return:
             self.clearFocus()
+        elif event.key() == Qt.Key_Escape:
+            self.setPlainText(self.value)
+            self.clearFocus()
+        elif event.key() == Qt.Key_Tab:
+            # editing the next value takes the focus away from this one
+            if not self.port.block().editNextValue(self.port):
+                self.clearFocus()
         else:
             super(QNEValue, self).keyPressEvent(event)
 
 
-    def focusInEvent(self, event):
-        super(QNEValue, self).focusInEvent(event)
-        self.setPlainText(self.value)
-        self.parent.setZValue(1)
-
-
     def focusOutEvent(self, event):
         super(QNEValue, self).focusOutEvent(event)
+        if self.closed:
+            return
+        self.closed = True
+
         value = self.toPlainText()
+        port = self.port
         if self.value != value:
-            port = self.port;
-            block = self.port.block()
+            block = port.block()
             block.nodeEditor().onChangeValue(block, port, value)
-        self.showValue(self.value)
-        self.parent.setZValue(0)
-
-
-    def showValue(self, value):
-        self.value = value
-
-        value_ = value
-        if len(value) > 9:
-            value_ = value[:6] + "..."
-        self.setPlainText(value_)
+        port.closeEditor()
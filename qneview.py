@@ -0,0 +1,110 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import math
+
+from PySide.QtCore import QLineF
+from PySide.QtGui import (QPen, QPainter)
+from PySide.QtGui import (QApplication, QGraphicsView)
+
+class QNEView(QGraphicsView):
+    (QualityProfile, PerformanceProfile) = (0, 1)
+
+    def __init__(self, parent):
+        super(QNEView, self).__init__(parent)
+
+        self.gridSize = 25
+        # grid lines closer together than this (in pixels) are thinned out
+        self.minGridSpacing = 8
+        self.backgroundColor = QApplication.palette().window().color()
+        self.gridPen = QPen(self.backgroundColor.darker(103), 0)
+
+        self.m_profile = None
+        self.setProfile(self.PerformanceProfile)
+
+
+    def setProfile(self, profile):
+        self.m_profile = profile
+
+        if profile == self.PerformanceProfile:
+            # the background is only redrawn when the view scrolls or zooms
+            self.setCacheMode(QGraphicsView.CacheBackground)
+            self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
+        else:
+            self.setCacheMode(QGraphicsView.CacheNone)
+            self.setViewportUpdateMode(QGraphicsView.MinimalViewportUpdate)
+
+        self.updateOptimizationFlags()
+
+        self.resetCachedContent()
+        self.viewport().update()
+
+
+    def setRenderHint(self, hint, enabled = True):
+        super(QNEView, self).setRenderHint(hint, enabled)
+        self.updateOptimizationFlags()
+
+
+    def updateOptimizationFlags(self):
+        # all items set their pen and brush before they draw
+        fast = (self.m_profile == self.PerformanceProfile)
+        self.setOptimizationFlag(QGraphicsView.DontSavePainterState, fast)
+
+        # antialiased edges reach half a pixel beyond the exposed rects,
+        # and would be clipped if these were not adjusted for it
+        antialiased = bool(self.renderHints() & QPainter.Antialiasing)
+        self.setOptimizationFlag(QGraphicsView.DontAdjustForAntialiasing, fast and not antialiased)
+
+
+    def profile(self):
+        return self.m_profile
+
+
+    def drawBackground(self, painter, rect):
+        if self.m_profile != self.PerformanceProfile:
+            super(QNEView, self).drawBackground(painter, rect)
+            return
+
+        painter.fillRect(rect, self.backgroundColor)
+
+        # keep the number of grid lines bounded at any zoom level
+        scale = self.transform().m11()
+        spacing = self.gridSize
+        while spacing * scale < self.minGridSpacing:
+            spacing *= 4
+
+        lines = []
+        x = math.floor(rect.left() / spacing) * spacing
+        while x < rect.right():
+            lines.append(QLineF(x, rect.top(), x, rect.bottom()))
+            x += spacing
+        y = math.floor(rect.top() / spacing) * spacing
+        while y < rect.bottom():
+            lines.append(QLineF(rect.left(), y, rect.right(), y))
+            y += spacing
+
+        painter.setPen(self.gridPen)
+        painter.drawLines(lines)
@@ -31,8 +31,11 @@ from PySide.QtGui import (QApplication, QGraphicsView, QGraphicsItem,
     QGraphicsPathItem, QGraphicsSceneMouseEvent)
 
 from qneblock import QNEBlock
-from qneport import QNEPort
-from qneconnection import QNEConnection
+from qneport import (QNEPort, QNEPortStub)
+from qneconnection import (QNEConnection, QNEConnectionIndex)
+from qnemetrics import QNEMetrics
+from qneshadow import QNEShadow
+from qneview import QNEView
 
 class QNodesEditor(QObject):
     def __init__(self, parent, scene, view):
@@ -66,6 +69,83 @@ class QNodesEditor(QObject):
         self.view.setRenderHint(QPainter.Antialiasing)
 
         self.connection = None
+        self.connectionIndex = QNEConnectionIndex()
+
+        self.m_blockCacheMode = QGraphicsItem.NoCache
+        if isinstance(self.view, QNEView):
+            self.setRenderProfile(self.view.profile())
+
+        # below these scales values, labels and ports are hidden in turn
+        self.detailThresholds = [0.6, 0.4, 0.25]
+        self.m_detailLevel = QNEPort.FullDetail
+
+
+    def setDetailThresholds(self, values, labels, ports):
+        self.detailThresholds = [values, labels, ports]
+
+
+    def detailLevelForScale(self, scale):
+        level = QNEPort.FullDetail
+        for threshold in self.detailThresholds:
+            if scale < threshold:
+                level += 1
+
+        return level
+
+
+    def setScale(self, scale):
+        if QNEShadow.setScale(scale):
+            self.updateShadows()
+
+        level = self.detailLevelForScale(scale)
+        if level == self.m_detailLevel:
+            return
+
+        self.m_detailLevel = level
+        for item in self.scene.items():
+            # including the blocks of collapsed groups
+            if isinstance(item, QNEBlock):
+                item.setDetailLevel(level)
+
+
+    def setBlockCount(self, count):
+        if QNEShadow.setBlockCount(count):
+            self.updateShadows()
+
+
+    def setShadowMode(self, mode):
+        QNEShadow.setMode(mode)
+        self.updateShadows()
+
+
+    def updateShadows(self):
+        for item in self.scene.items():
+            if isinstance(item, QNEBlock):
+                item.updateShadow()
+
+
+    def detailLevel(self):
+        return self.m_detailLevel
+
+
+    def setRenderProfile(self, profile):
+        # static block bodies are cached as pixmaps in the performance
+        # profile; values and labels are separate items, so ticking values
+        # do not invalidate the cache
+        if profile == QNEView.PerformanceProfile:
+            self.m_blockCacheMode = QGraphicsItem.DeviceCoordinateCache
+        else:
+            self.m_blockCacheMode = QGraphicsItem.NoCache
+
+        if isinstance(self.view, QNEView):
+            self.view.setProfile(profile)
+        for item in self.scene.items():
+            if isinstance(item, QNEBlock):
+                item.setCacheMode(self.m_blockCacheMode)
+
+
+    def blockCacheMode(self):
+        return self.m_blockCacheMode
 
 
     def selectNone(self):
@@ -102,6 +182,10 @@ class QNodesEditor(QObject):
         items = self.scene.items(QRectF( position - QPointF(2,2) , QSizeF(4,4) ))
 
         for item in items:
+            if item.type() == QNEPortStub.Type:
+                # stubs can not be connected; a press on one is a press on
+                # its block
+                return item.block()
             if item.type() > QGraphicsItem.UserType:
                 return item
 
@@ -109,7 +193,11 @@ class QNodesEditor(QObject):
 
 
     def eventFilter(self, object, event):
-        if event.type() == QEvent.GraphicsSceneMousePress:
+        if event.type() == QEvent.FontChange:
+            # cached label measurements are only valid for the old font
+            QNEMetrics.invalidate()
+
+        elif event.type() == QEvent.GraphicsSceneMousePress:
             self.mousePressOnBlock = False
             self.mouseDragged = False
 
@@ -129,6 +217,13 @@ class QNodesEditor(QObject):
                     return True
 
                 elif item and item.type() == QNEBlock.Type:
+                    # values are painted by their port; writable ones get an
+                    # editor when clicked
+                    port = item.portAt(event.scenePos())
+                    if port and port.isWritable() and port.isValueAt(event.scenePos()):
+                        port.editValue()
+                        return True
+
                     self.mousePressOnBlock = True
                     return False
 
@@ -156,6 +251,7 @@ class QNodesEditor(QObject):
                         self.connection.setPos2(port2.scenePos())
                         self.connection.setPort2(port2)
                         self.connection.updatePath()
+                        self.connectionIndex.add(self.connection)
                         if port1.isOutput():
                             self.onAddConnection(self.connection, port1, port2)
                         else:
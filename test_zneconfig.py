@@ -0,0 +1,118 @@
+import json
+import uuid
+
+import pytest
+
+# zneconfig runs its file tasks in a QThread, but needs no display
+pytest.importorskip("PySide.QtCore")
+
+from znemodel import ZNENetworkModel
+from zneconfig import (describeNetwork, describePlan, normalizeDescription, planRestore,
+    readDescription, writeDescription)
+
+
+def liveNetwork():
+    model = ZNENetworkModel()
+    (a, b) = (uuid.uuid4(), uuid.uuid4())
+    model.peerEnter(a, "a")
+    model.peerEnter(b, "b")
+    model.peerModified(a, {
+        "out": {"access": "re", "value": 1, "typeHint": "int", "subscribers": [[b.hex, "in"]]},
+        "_zne_position": [0, 0],
+    })
+    model.peerModified(b, {"in": {"access": "rws", "value": 1, "typeHint": "int"}})
+    return (model, a, b)
+
+
+def test_unchanged_network_needs_no_restore():
+    (model, a, b) = liveNetwork()
+
+    assert planRestore(describeNetwork(model), model) == []
+
+
+def test_restore_plans_the_differences():
+    (model, a, b) = liveNetwork()
+    description = describeNetwork(model)
+    description["a"]["out"]["subscribers"] = []
+    description["a"]["_zne_position"] = [5, 5]
+    description["b"]["in"]["value"] = 7
+
+    plan = planRestore(description, model)
+
+    assert [step.peer.name for step in plan] == ["a", "b"]
+    assert plan[0].values == {"_zne_position": [5, 5]}
+    assert [(peer.name, receiver, emitter) for (peer, receiver, emitter) in plan[0].unsubscribe] == \
+        [("b", "in", "out")]
+    assert plan[1].values == {"in": {"value": 7}}
+
+    (summary, details) = describePlan(plan)
+    assert summary.startswith("2 values on 2 peers")
+    assert "unsubscribe in on b from out" in details
+
+
+def test_peers_with_the_same_name_are_restored_each():
+    (model, a, b) = liveNetwork()
+    c = uuid.uuid4()
+    model.peerEnter(c, "b")
+    model.peerModified(c, {"in": {"access": "rws", "value": 1, "typeHint": "int"}})
+
+    description = describeNetwork(model)
+    description["b"]["in"]["value"] = 3
+    plan = planRestore(description, model)
+
+    assert sorted(step.peer.hex for step in plan if step.values) == sorted([b.hex, c.hex])
+    # the subscription to "b" now goes to both peers named b
+    (step, ) = [step for step in plan if step.peer.hex == a.hex]
+    assert [peer.hex for (peer, receiver, emitter) in step.subscribe] == [c.hex]
+    assert str(c) in describePlan(plan)[1]
+
+
+def test_subscribers_by_uuid():
+    (model, a, b) = liveNetwork()
+    description = {"a": {"out": {"subscribers": [[str(b), "in"], [b.hex, "other"]]}}}
+
+    plan = planRestore(description, model)
+
+    assert [(peer.hex, receiver) for (peer, receiver, emitter) in plan[0].subscribe] == \
+        [(b.hex, "other")]
+
+
+def test_normalize_description():
+    description = {
+        "a": {"out": {"subscribers": [["b", "in"], ["bad"], "x", ["c", 1]]}},
+        "b": {"in": {"subscribers": "none"}},
+        "junk": 3,
+    }
+
+    assert normalizeDescription(description) == {
+        "a": {"out": {"subscribers": [["b", "in"], ["c", "1"]]}},
+        "b": {"in": {"subscribers": []}},
+    }
+    assert normalizeDescription([]) is None
+
+
+def test_write_and_read(tmp_path):
+    (model, a, b) = liveNetwork()
+    fileName = str(tmp_path / "network.zocp")
+    progress = []
+
+    assert writeDescription(fileName, describeNetwork(model), progress.append) == fileName
+    assert progress[-1] == 100
+    assert readDescription(fileName) == describeNetwork(model)
+
+
+def test_cancelled_write_keeps_the_file(tmp_path):
+    fileName = tmp_path / "network.zocp"
+    fileName.write_text("{}")
+
+    assert writeDescription(str(fileName), {"a": {}}, cancelled=lambda: True) is None
+    assert fileName.read_text() == "{}"
+    assert not (tmp_path / "network.zocp.part").exists()
+
+
+def test_read_rejects_other_files(tmp_path):
+    fileName = tmp_path / "list.json"
+    fileName.write_text(json.dumps([1, 2]))
+
+    with pytest.raises(ValueError):
+        readDescription(str(fileName))
@@ -0,0 +1,190 @@
+import uuid
+
+from znemodel import (ZNENetworkModel, ZNEHistory, ZNEPendingSubscribers, parseValue)
+
+
+class Recorder(object):
+    # collects the notifications of a model
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if not name.startswith("onModel"):
+            raise AttributeError(name)
+        return lambda *args: self.calls.append((name, args))
+
+    def names(self):
+        return [call[0] for call in self.calls]
+
+
+def modelWithPeers(*names):
+    model = ZNENetworkModel()
+    uuids = [uuid.uuid4() for name in names]
+    for (peerUuid, name) in zip(uuids, names):
+        model.peerEnter(peerUuid, name)
+    return (model, uuids)
+
+
+def test_added_capabilities_and_metadata():
+    (model, (a, )) = modelWithPeers("a")
+    listener = Recorder()
+    model.addListener(listener)
+
+    model.peerModified(a, {
+        "out": {"access": "re", "value": 1, "typeHint": "int"},
+        "_zne_position": [10, 20],
+    })
+
+    capability = model.capability(a.hex, "out")
+    assert capability.value == 1
+    assert capability.canEmit() and not capability.canSet()
+    assert model.peer(a.hex).metadata["_zne_position"] == [10, 20]
+    assert listener.names() == ["onModelCapabilitiesAdded", "onModelMetadataChanged",
+        "onModelPeerModified"]
+
+
+def test_resent_trees_are_skipped():
+    (model, (a, )) = modelWithPeers("a")
+    tree = {
+        "out": {"access": "re", "value": 1, "typeHint": "int", "subscribers": []},
+        "_zne_position": [10, 20],
+    }
+    model.peerModified(a, tree)
+    listener = Recorder()
+    model.addListener(listener)
+
+    model.peerModified(a, tree)
+
+    assert listener.names() == ["onModelPeerModified"]
+    assert model.updatesSkipped == 2
+
+
+def test_changed_fields_only():
+    (model, (a, )) = modelWithPeers("a")
+    model.peerModified(a, {"out": {"access": "re", "value": 1, "typeHint": "int"}})
+    listener = Recorder()
+    model.addListener(listener)
+
+    model.peerModified(a, {"out": {"access": "re", "value": 2, "typeHint": "int"}})
+
+    (name, (peer, capability, fields)) = listener.calls[0]
+    assert name == "onModelCapabilityChanged"
+    assert fields == ["value"]
+
+
+def test_value_type_change_is_a_change():
+    (model, (a, )) = modelWithPeers("a")
+    model.peerModified(a, {"out": {"access": "re", "value": 1}})
+    model.peerModified(a, {"out": {"value": 1.0}})
+
+    assert type(model.capability(a.hex, "out").value) is float
+
+
+def test_subscriptions_by_receiver():
+    (model, (a, b)) = modelWithPeers("a", "b")
+    listener = Recorder()
+    model.addListener(listener)
+
+    model.peerModified(a, {"out": {"access": "re", "subscribers": [[b.hex, "in"]]}})
+    assert model.subscriptionsTo(b.hex) == {"in": {(a.hex, "out")}}
+
+    model.peerModified(a, {"out": {"subscribers": [[b.hex, "other"]]}})
+    assert model.subscriptionsTo(b.hex) == {"other": {(a.hex, "out")}}
+    assert listener.names().count("onModelSubscribersChanged") == 2
+
+    model.peerExit(a)
+    assert model.subscriptionsTo(b.hex) == {}
+
+
+def test_signals_feed_histories():
+    (model, (a, )) = modelWithPeers("a")
+    model.peerModified(a, {
+        "num": {"access": "re", "value": 0, "typeHint": "int"},
+        "text": {"access": "re", "value": "", "typeHint": "string"},
+    })
+
+    assert model.setHistoryEnabled(a.hex, "num", True)
+    assert not model.setHistoryEnabled(a.hex, "text", True)
+    for value in range(3):
+        model.peerSignaled(a, "num", value)
+
+    assert list(model.capability(a.hex, "num").history.values()) == [0.0, 1.0, 2.0]
+    assert model.historyCount == 1
+    model.peerExit(a)
+    assert model.historyCount == 0
+
+
+def test_history_limit():
+    (model, (a, )) = modelWithPeers("a")
+    model.maxHistories = 1
+    model.peerModified(a, {
+        "x": {"access": "re", "typeHint": "flt"},
+        "y": {"access": "re", "typeHint": "flt"},
+    })
+
+    assert model.setHistoryEnabled(a.hex, "x", True)
+    assert not model.setHistoryEnabled(a.hex, "y", True)
+    assert not model.setHistoryEnabled(a.hex, "x", False)
+    assert model.setHistoryEnabled(a.hex, "y", True)
+
+
+def test_history_ring_buffer():
+    history = ZNEHistory(3, 2)
+    for value in range(5):
+        history.append([value, -value])
+
+    assert list(history.values(0)) == [2.0, 3.0, 4.0]
+    assert list(history.values(1)) == [-2.0, -3.0, -4.0]
+    assert history.range() == (-4.0, 4.0)
+
+    history.clear()
+    assert history.count == 0
+    assert history.range() == (0.0, 0.0)
+
+
+def test_pending_subscribers_resolve():
+    pending = ZNEPendingSubscribers()
+    pending.add(("a", "out"), ("b", "in"), 0)
+    pending.add(("c", "out"), ("b", "in"), 0)
+
+    assert sorted(pending.resolve(("b", "in"))) == [("a", "out"), ("c", "out")]
+    assert pending.isEmpty()
+    assert pending.resolvedCount == 2
+
+
+def test_pending_subscribers_expire():
+    pending = ZNEPendingSubscribers(timeout = 60)
+    pending.add(("a", "out"), ("b", "in"), 0)
+    # adding it again keeps the original deadline
+    pending.add(("a", "out"), ("b", "in"), 50)
+    pending.add(("a", "out"), ("b", "other"), 30)
+
+    assert pending.expire(70) == 1
+    assert len(pending) == 1
+    assert pending.expire(100) == 1
+    assert pending.isEmpty()
+    assert pending.expiredCount == 2
+
+
+def test_pending_subscribers_discard():
+    pending = ZNEPendingSubscribers()
+    pending.add(("a", "out"), ("b", "in"), 0)
+    pending.add(("a", "out"), ("c", "in"), 0)
+    pending.add(("a", "other"), ("c", "in"), 0)
+
+    pending.discardEmitter(("a", "out"), keep = {("c", "in")})
+    assert len(pending) == 2
+
+    pending.discardPeer("a")
+    assert pending.isEmpty()
+    assert not pending.byEmitter and not pending.byEmitterPeer
+
+
+def test_parse_value():
+    assert parseValue("int", "3.7") == (True, 3)
+    assert parseValue("flt", " 2.5 ") == (True, 2.5)
+    assert parseValue("bool", "Yes") == (True, True)
+    assert parseValue("vec3f", "[1, 2, 3]") == (True, [1.0, 2.0, 3.0])
+    assert parseValue("vec3f", "[1, 2]")[0] is False
+    assert parseValue("int", "nope") == (False, "nope")
+    assert parseValue("string", "text") == (True, "text")
@@ -0,0 +1,84 @@
+import uuid
+
+import pytest
+
+# the recorder and replay are Qt objects, but need no display
+pytest.importorskip("PySide.QtCore")
+
+from znerecorder import (recordingMagic, encodeEvent, decodeEvent, recordEnd,
+    PeerEnter, PeerExit, PeerModified, PeerSignaled)
+
+
+peer = uuid.uuid4()
+
+
+def events(buffer):
+    # all events of a recording, skipping damaged records like ZNEReplay
+    offset = len(recordingMagic)
+    decoded = []
+    skipped = 0
+    while True:
+        try:
+            (event, offset) = decodeEvent(buffer, offset)
+        except ValueError:
+            skipped += 1
+            offset = recordEnd(buffer, offset)
+            continue
+        if event is None:
+            return (decoded, skipped)
+        decoded.append(event)
+
+
+def test_round_trip():
+    buffer = (recordingMagic +
+        encodeEvent(1.0, PeerEnter, peer, "peer@host", None) +
+        encodeEvent(2.0, PeerModified, peer, "peer@host", {"out": {"value": 1}}) +
+        encodeEvent(3.0, PeerSignaled, peer, "peer@host", ["out", [1.5, 2]]) +
+        encodeEvent(4.0, PeerExit, peer, "peer@host", None))
+
+    (decoded, skipped) = events(buffer)
+
+    assert skipped == 0
+    assert decoded == [
+        (1.0, PeerEnter, peer, "peer@host", None),
+        (2.0, PeerModified, peer, "peer@host", {"out": {"value": 1}}),
+        (3.0, PeerSignaled, peer, "peer@host", ["out", [1.5, 2]]),
+        (4.0, PeerExit, peer, "peer@host", None),
+    ]
+
+
+def test_truncated_recording_ends_at_last_record():
+    buffer = (recordingMagic +
+        encodeEvent(1.0, PeerEnter, peer, "peer", None) +
+        encodeEvent(2.0, PeerExit, peer, "peer", None)[:-1])
+
+    (decoded, skipped) = events(buffer)
+
+    assert [event[0] for event in decoded] == [1.0]
+    assert skipped == 0
+
+
+def test_damaged_records_are_skipped():
+    damaged = bytearray(encodeEvent(2.0, PeerModified, peer, "peer", {"out": 1}))
+    damaged[-2] = 0xff
+    buffer = (recordingMagic +
+        encodeEvent(1.0, PeerEnter, peer, "peer", None) +
+        bytes(damaged) +
+        encodeEvent(3.0, PeerModified, peer, "peer", ["not", "a", "tree"]) +
+        encodeEvent(4.0, PeerSignaled, peer, "peer", {"not": "a signal"}) +
+        encodeEvent(5.0, 99, peer, "peer", None) +
+        encodeEvent(6.0, PeerExit, peer, "peer", None))
+
+    (decoded, skipped) = events(buffer)
+
+    assert [event[0] for event in decoded] == [1.0, 6.0]
+    assert skipped == 4
+
+
+def test_record_end():
+    record = encodeEvent(1.0, PeerEnter, peer, "peer", None)
+    buffer = recordingMagic + record
+
+    assert recordEnd(buffer, len(recordingMagic)) == len(buffer)
+    assert recordEnd(buffer, len(buffer)) is None
+    assert recordEnd(buffer[:-1], len(recordingMagic)) is None
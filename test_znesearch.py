@@ -0,0 +1,78 @@
+from znesearch import (ZNESearchIndex, PeerName, PortName, PortValue, maxValueLength)
+
+
+def indexWithMixer():
+    index = ZNESearchIndex()
+    index.addPeer("a", "Mixer@studio")
+    index.updatePort("a", "volume", 0.5)
+    index.updatePort("a", "mute", False)
+    return index
+
+
+def test_search_names_and_values():
+    index = indexWithMixer()
+
+    assert index.search("mix") == [(("a", None, PeerName), "mixer@studio")]
+    assert index.search("VOL") == [(("a", "volume", PortName), "volume")]
+    assert index.search("0.5") == [(("a", "volume", PortValue), "0.5")]
+    assert index.search("false") == [(("a", "mute", PortValue), "false")]
+    assert index.search("nothing") == []
+    assert index.search("  ") == []
+
+
+def test_long_queries_are_checked():
+    index = indexWithMixer()
+
+    # all trigrams of the query occur, but not the query itself
+    index.addPeer("b", "abcxbcd")
+    assert index.search("abcd") == []
+    assert [key for (key, text) in index.search("studio")] == [("a", None, PeerName)]
+
+
+def test_prefix_matches_first():
+    index = ZNESearchIndex()
+    index.addPeer("a", "big gain")
+    index.addPeer("b", "gain")
+
+    assert [key[0] for (key, text) in index.search("gain")] == ["b", "a"]
+
+
+def test_changes_are_reported():
+    index = ZNESearchIndex()
+
+    assert index.addPeer("a", "mixer")
+    assert not index.addPeer("a", "mixer")
+    assert index.updatePort("a", "volume", 1)
+    assert not index.updatePort("a", "volume", 1)
+    assert index.updatePort("a", "volume", 2)
+    assert index.search("1") == []
+
+
+def test_remove_port_and_peer():
+    index = indexWithMixer()
+
+    assert index.removePort("a", "volume")
+    assert not index.removePort("a", "volume")
+    assert index.ports("a") == {"mute"}
+    assert index.search("volume") == []
+
+    assert index.removePeer("a")
+    assert len(index) == 0
+    assert not index.postings
+    assert index.ports("a") == frozenset()
+
+
+def test_long_values_are_cut():
+    index = ZNESearchIndex()
+    index.updatePort("a", "text", "x" * 100 + "tail")
+
+    assert len(index.texts[("a", "text", PortValue)]) == maxValueLength
+    assert index.search("tail") == []
+
+
+def test_limit():
+    index = ZNESearchIndex()
+    for number in range(10):
+        index.addPeer(str(number), "peer %d" % number)
+
+    assert len(index.search("peer", limit = 3)) == 3
@@ -1,29 +1,31 @@
 #!/usr/bin/python3
 
-from PySide.QtCore import (Qt, QTimer, QSocketNotifier)
-from PySide.QtGui import (QPainter, QBrush, QPalette, QIcon, QTransform)
+from PySide.QtCore import (Qt, QTimer, QSocketNotifier, QPointF, QRectF)
+from PySide.QtGui import (QPainter, QBrush, QPalette, QIcon, QTransform, QFont)
 from PySide.QtGui import (QApplication, QMainWindow, QMessageBox, QFileDialog,
-    QAction, QGraphicsScene, QGraphicsView)
+    QAction, QGraphicsScene, QLabel, QProgressDialog, QInputDialog,
+    QLineEdit, QCompleter, QStringListModel)
 
 from zocp import ZOCP
 import zmq
 
 import logging
 import socket
+import time
 
 from qnodeseditor import QNodesEditor
 from qneblock import QNEBlock
 from qneport import QNEPort
 from qneconnection import QNEConnection
-
-try:
-    from zconfigmanager import ZConfigManagerNode
-    zconfigmanager_found = True
-except ImportError:
-    print ("Could not find ZConfigManagerNode class. "
-           "Load/Save functionality will not be available. Please follow "
-           "the instruction in the README to add this class.")
-    zconfigmanager_found = False
+from qnegroup import (QNEGroupBlock, QNEBundle)
+from qneprofiler import QNEProfiler
+from qneview import QNEView
+from znemodel import (ZNENetworkModel, ZNEPendingSubscribers, parseValue)
+from zneconfig import (ZNEConfigWorker, describeNetwork, writeDescription,
+    readDescription, planRestore, describePlan)
+from znesearch import (ZNESearchIndex, PortValue)
+from znerecorder import (ZNERecorder, ZNEReplay, ZNEMutedZOCP, PeerEnter,
+    PeerExit, PeerModified, PeerSignaled)
 
 class QNEMainWindow(QMainWindow):
     def __init__(self, parent):
@@ -37,7 +39,7 @@ class QNEMainWindow(QMainWindow):
         self.setWindowIcon(QIcon('assets/icon.png'))
 
         self.scene = QGraphicsScene(self)
-        self.view = QGraphicsView(self)
+        self.view = QNEView(self)
         self.view.setScene(self.scene)
         self.setCentralWidget(self.view)
 
@@ -48,34 +50,148 @@ class QNEMainWindow(QMainWindow):
         self.nodesEditor.onBlockMoved = self.onBlockMoved
 
         self.scale = 1
+        self.initProfilerOverlay()
+
+        # block positions are kept locally and written to the peers after
+        # positionSyncDelay ms without moves, or every positionSyncInterval
+        # ms if that is set
+        self.pendingPositions = {}
+        self.sentPositions = {}
+        self.positionSyncDelay = 250
+        self.positionSyncInterval = 0
+        self.positionTimer = QTimer(self)
+        self.positionTimer.setSingleShot(True)
+        self.positionTimer.timeout.connect(self.flushPositions)
+
+        # in viewport mode the editor only subscribes to the signals of peers
+        # whose blocks are in or near the visible part of the scene; peers
+        # are subscribed within enterMargin and unsubscribed beyond
+        # leaveMargin (both relative to the size of the viewport)
+        self.viewportSubscriptions = False
+        self.viewportEnterMargin = 0.25
+        self.viewportLeaveMargin = 0.75
+        self.signalSubscriptions = set()
+        self.viewportTimer = QTimer(self)
+        self.viewportTimer.setSingleShot(True)
+        self.viewportTimer.setInterval(200)
+        self.viewportTimer.timeout.connect(self.onViewportChanged)
+        self.view.horizontalScrollBar().valueChanged.connect(self.scheduleViewportUpdate)
+        self.view.verticalScrollBar().valueChanged.connect(self.scheduleViewportUpdate)
+
+        # saving and loading network descriptions
+        self.configWorker = None
+        self.restorePlan = []
+        self.restoreProgress = None
+        self.restoreBatchSize = 20
+        self.restoreTimer = QTimer(self)
+        self.restoreTimer.timeout.connect(self.onRestoreTimer)
+
+        # recording the incoming events, and replaying them instead of the
+        # live network
+        self.recorder = None
+        self.replay = None
+        self.liveState = None
+
+        # search over peer names, port names and values; the index is kept
+        # up to date by the ZOCP callbacks
+        self.searchIndex = ZNESearchIndex()
+        self.searchResults = {}
+        self.searchMatches = set()
+        self.searchEdited = False
+
         self.installActions()
+        self.initSearch()
 
-        self.initZOCP()
+        # ZOCP callbacks update the network model; the scene follows the
+        # model through its change notifications
+        self.model = ZNENetworkModel()
+        self.model.addListener(self)
 
         self.nodes = {}
-        self.pendingSubscribers = {}
+
+        # blocks are only created for peers that match the peer filter and
+        # are within blockEnterMargin of the view, and deleted again beyond
+        # blockLeaveMargin; blockRects holds the scene rects of all peers
+        # with capabilities, estimated for those without a block
+        self.peerFilter = ""
+        self.blockRects = {}
+        self.portStates = {}
+
+        # peers can be grouped by the host part of their name, or by hand;
+        # collapsed groups are drawn as a single block, and subscriptions
+        # from and to them as bundled edges
+        self.groupByHost = False
+        self.manualGroups = {}
+        self.collapsedGroups = {}
+        self.groupMembers = {}
+        self.groupBlocks = {}
+        self.bundles = {}
+        self.groupsDirty = False
+        self.bundlesDirty = False
+
+        self.blockEnterMargin = 0.5
+        self.blockLeaveMargin = 1.0
+
+        # subscriptions to ports that do not exist yet; unresolved ones are
+        # swept every few seconds once they expire
+        self.pendingSubscribers = ZNEPendingSubscribers()
+        self.pendingTimer = QTimer(self)
+        self.pendingTimer.setInterval(5000)
+        self.pendingTimer.timeout.connect(self.expirePendingSubscribers)
+
+        # Incoming signals only update the model; ports are marked dirty and
+        # the display is refreshed at a fixed rate so text relayout scales
+        # with the frame rate instead of the message rate
+        self.dirtyValues = set()
+        self.valueUpdatesReceived = 0
+        self.valueUpdatesDropped = 0
+
+        # values set by the user that the peer has not answered yet
+        self.pendingEdits = set()
+        self.valueTimer = QTimer(self)
+        self.valueTimer.timeout.connect(self.flushValues)
+        self.setValueUpdateRate(30)
+
+        self.initZOCP()
 
         QTimer.singleShot(250, lambda: self.scene.invalidate())
 
 
     def closeEvent(self, *args):
+        if self.recorder:
+            self.recorder.stop()
+        self.flushPositions()
         self.zocp.stop()
 
 
     def installActions(self):
         quitAct = QAction("&Quit", self, shortcut="Ctrl+Q",
             statusTip="Exit the application", triggered=self.close)
-        if zconfigmanager_found:
-            openAct = QAction("&Open...", self, shortcut="Ctrl+O",
-                statusTip="Restore the network from a saved description", triggered=self.readNetwork)
-            saveAct = QAction("&Save...", self, shortcut="Ctrl+S",
-                statusTip="Write a description of the network to disc", triggered=self.writeNetwork)
+        openAct = QAction("&Open...", self, shortcut="Ctrl+O",
+            statusTip="Restore the network from a saved description", triggered=self.readNetwork)
+        saveAct = QAction("&Save...", self, shortcut="Ctrl+S",
+            statusTip="Write a description of the network to disc", triggered=self.writeNetwork)
+        self.recordAct = QAction("&Record Events...", self, checkable=True,
+            statusTip="Write all events received from the network to a recording",
+            triggered=self.setRecording)
+        replayAct = QAction("Re&play Recording...", self,
+            statusTip="Show a recorded network at the pace it was recorded at",
+            triggered=lambda: self.startReplay(True))
+        replayFastAct = QAction("Replay Recording &Fast...", self,
+            statusTip="Show a recorded network as fast as possible",
+            triggered=lambda: self.startReplay(False))
+        self.stopReplayAct = QAction("S&top Replay", self, enabled=False,
+            statusTip="Return to the live network", triggered=self.stopReplay)
 
         fileMenu = self.menuBar().addMenu("&File")
-        if zconfigmanager_found:
-            fileMenu.addAction(openAct)
-            fileMenu.addAction(saveAct)
-            fileMenu.addSeparator()
+        fileMenu.addAction(openAct)
+        fileMenu.addAction(saveAct)
+        fileMenu.addSeparator()
+        fileMenu.addAction(self.recordAct)
+        fileMenu.addAction(replayAct)
+        fileMenu.addAction(replayFastAct)
+        fileMenu.addAction(self.stopReplayAct)
+        fileMenu.addSeparator()
         fileMenu.addAction(quitAct)
 
         # for shortcuts
@@ -89,6 +205,12 @@ class QNEMainWindow(QMainWindow):
             triggered=self.nodesEditor.selectInverse)
         deleteSelectedAct = QAction("&Delete Selected", self, shortcut="Del",
             triggered=self.nodesEditor.deleteSelected)
+        findAct = QAction("&Find...", self, shortcut="Ctrl+F",
+            statusTip="Search peers and ports", triggered=self.focusSearch)
+        groupSelectedAct = QAction("&Group Selected...", self, shortcut="Ctrl+G",
+            statusTip="Show the selected peers as a single block", triggered=self.groupSelected)
+        ungroupSelectedAct = QAction("&Ungroup Selected", self, shortcut="Ctrl+Shift+G",
+            triggered=self.ungroupSelected)
 
         editMenu = self.menuBar().addMenu("&Edit")
         editMenu.addAction(selectAllAct)
@@ -96,11 +218,19 @@ class QNEMainWindow(QMainWindow):
         editMenu.addAction(selectInverseAct)
         editMenu.addSeparator()
         editMenu.addAction(deleteSelectedAct)
+        editMenu.addSeparator()
+        editMenu.addAction(findAct)
+        editMenu.addSeparator()
+        editMenu.addAction(groupSelectedAct)
+        editMenu.addAction(ungroupSelectedAct)
 
         self.view.addAction(selectAllAct)
         self.view.addAction(selectNoneAct)
         self.view.addAction(selectInverseAct)
         self.view.addAction(deleteSelectedAct)
+        self.view.addAction(findAct)
+        self.view.addAction(groupSelectedAct)
+        self.view.addAction(ungroupSelectedAct)
 
         zoomInAct = QAction("Zoom &In", self, shortcut="Ctrl++",
             triggered=self.zoomIn)
@@ -109,15 +239,47 @@ class QNEMainWindow(QMainWindow):
         zoomResetAct = QAction("&Reset Zoom", self, shortcut="Ctrl+0",
             triggered=self.zoomReset)
 
+        fastRenderingAct = QAction("&Fast Rendering", self, checkable=True,
+            checked=(self.view.profile() == QNEView.PerformanceProfile),
+            statusTip="Cache the background and blocks, at the cost of some rendering quality",
+            triggered=self.setFastRendering)
+        viewportSubscriptionsAct = QAction("Receive &Visible Signals Only", self,
+            checkable=True, statusTip="Only subscribe to the signals of peers that are in view",
+            triggered=self.setViewportSubscriptions)
+        groupByHostAct = QAction("Group Peers by &Host", self, checkable=True,
+            statusTip="Group peers named name@host by host", triggered=self.setGroupByHost)
+        expandGroupsAct = QAction("E&xpand All Groups", self,
+            triggered=lambda: self.setAllGroupsCollapsed(False))
+        collapseGroupsAct = QAction("&Collapse All Groups", self,
+            triggered=lambda: self.setAllGroupsCollapsed(True))
+        filterAct = QAction("F&ilter Peers...", self, shortcut="Ctrl+Shift+F",
+            statusTip="Only show the peers whose name contains a text", triggered=self.editPeerFilter)
+        profilerAct = QAction("&Performance Overlay", self, shortcut="F12",
+            checkable=True, triggered=self.setProfilerOverlayVisible)
+        exportProfileAct = QAction("&Export Performance Data...", self,
+            statusTip="Write the collected timings to a JSON file", triggered=self.exportProfile)
+
         viewMenu = self.menuBar().addMenu("&View")
         viewMenu.addAction(zoomInAct)
         viewMenu.addAction(zoomOutAct)
         viewMenu.addSeparator()
         viewMenu.addAction(zoomResetAct)
+        viewMenu.addSeparator()
+        viewMenu.addAction(fastRenderingAct)
+        viewMenu.addAction(viewportSubscriptionsAct)
+        viewMenu.addSeparator()
+        viewMenu.addAction(filterAct)
+        viewMenu.addAction(groupByHostAct)
+        viewMenu.addAction(expandGroupsAct)
+        viewMenu.addAction(collapseGroupsAct)
+        viewMenu.addSeparator()
+        viewMenu.addAction(profilerAct)
+        viewMenu.addAction(exportProfileAct)
 
         self.view.addAction(zoomInAct)
         self.view.addAction(zoomOutAct)
         self.view.addAction(zoomResetAct)
+        self.view.addAction(profilerAct)
 
         aboutAct = QAction("&About", self,
              triggered=self.about)
@@ -128,23 +290,153 @@ class QNEMainWindow(QMainWindow):
         self.view.addAction(aboutAct)
 
 
+    def initSearch(self):
+        self.searchBox = QLineEdit(self)
+        self.searchBox.setPlaceholderText("Search peers and ports")
+        self.searchBox.setMaximumWidth(300)
+
+        # results are filtered by the index, so the completer shows them all
+        self.searchModel = QStringListModel(self)
+        self.searchCompleter = QCompleter(self.searchModel, self)
+        self.searchCompleter.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.searchCompleter.activated[str].connect(self.onSearchActivated)
+        self.searchBox.setCompleter(self.searchCompleter)
+
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(150)
+        self.searchTimer.timeout.connect(self.updateSearch)
+        self.searchBox.textEdited.connect(self.onSearchEdited)
+        self.searchBox.returnPressed.connect(self.onSearchReturn)
+
+        toolBar = self.addToolBar("Search")
+        toolBar.setObjectName("searchToolBar")
+        toolBar.addWidget(self.searchBox)
+
+
+    def focusSearch(self):
+        self.searchBox.setFocus()
+        self.searchBox.selectAll()
+
+
+    def onSearchEdited(self, text):
+        self.searchEdited = True
+        self.searchTimer.start()
+
+
+    def onSearchIndexChanged(self):
+        # the results of the current query are refreshed as well; the timer
+        # is not restarted, so steady updates can not postpone that
+        if self.searchBox.text() and not self.searchTimer.isActive():
+            self.searchTimer.start()
+
+
+    @QNEProfiler.timed("updateSearch")
+    def updateSearch(self):
+        self.searchResults = {}
+        labels = []
+        for (key, text) in self.searchIndex.search(self.searchBox.text()):
+            (uuid, portname, field) = key
+            peer = self.model.peer(uuid)
+            if peer is None:
+                continue
+            if portname is None:
+                label = peer.name
+            elif field == PortValue:
+                label = "%s / %s = %s" % (peer.name, portname, text)
+            else:
+                label = "%s / %s" % (peer.name, portname)
+            if label not in self.searchResults:
+                self.searchResults[label] = key
+                labels.append(label)
+
+        self.searchModel.setStringList(labels)
+        self.setSearchMatches(set(key[0] for key in self.searchResults.values()))
+        # refreshes after index changes only update a list that is shown
+        if labels and (self.searchEdited or self.searchCompleter.popup().isVisible()):
+            self.searchCompleter.complete()
+        self.searchEdited = False
+
+
+    def setSearchMatches(self, matches):
+        for uuid in self.searchMatches - matches:
+            if uuid in self.nodes:
+                self.nodes[uuid]["block"].setHighlighted(False)
+        for uuid in matches - self.searchMatches:
+            if uuid in self.nodes:
+                self.nodes[uuid]["block"].setHighlighted(True)
+        self.searchMatches = matches
+        self.updateGroupHighlights()
+
+
+    def updateGroupHighlights(self):
+        # collapsed groups are highlighted when one of their members matches
+        for (group, block) in self.groupBlocks.items():
+            block.setHighlighted(any(uuid in self.searchMatches
+                for uuid in self.groupMembers.get(group, ())))
+
+
+    def onSearchReturn(self):
+        if self.searchTimer.isActive():
+            self.searchTimer.stop()
+            self.updateSearch()
+        labels = self.searchModel.stringList()
+        if labels:
+            self.onSearchActivated(labels[0])
+
+
+    def onSearchActivated(self, label):
+        key = self.searchResults.get(label)
+        if key is not None:
+            self.showSearchResult(key)
+
+
+    def showSearchResult(self, key):
+        (uuid, portname, field) = key
+        peer = self.model.peer(uuid)
+        if peer is None or uuid not in self.blockRects and uuid not in self.nodes:
+            # peers without capabilities have no block
+            return
+
+        # make sure the peer gets a block of its own
+        group = self.groupOf(peer)
+        if group is not None and self.collapsedGroups.get(group, True):
+            self.collapsedGroups[group] = False
+            self.groupsDirty = True
+        if not self.matchesFilter(peer):
+            self.setPeerFilter("")
+
+        if uuid in self.nodes:
+            self.view.centerOn(self.nodes[uuid]["block"])
+        else:
+            self.view.centerOn(self.blockRects[uuid].center())
+        self.onViewportChanged()
+
+        if uuid in self.nodes:
+            block = self.nodes[uuid]["block"]
+            self.nodesEditor.selectNone()
+            block.setSelected(True)
+            if portname is not None:
+                block.showPort(portname)
+
+
+    def indexPeer(self, peer):
+        self.searchIndex.addPeer(peer.hex, peer.name)
+        for capability in peer.capabilities.values():
+            self.searchIndex.updatePort(peer.hex, capability.name, capability.value)
+
+
     def writeNetwork(self):
         fileName, filter = QFileDialog.getSaveFileName(self,
                                                        caption="Save as",
                                                        filter="ZOCP (*.zocp);;JSON (*.json)",
                                                        selectedFilter="ZOCP (*.zocp)")
         if fileName:
-            # setup ZOCP node, and run it for some time to discover
-            # the current network
-            configManager = ZConfigManagerNode("ConfigManager@%s" % socket.gethostname())
-            configManager.discover(0.5)
-
-            # write network description to file
-            configManager.write(fileName)
-
-            # shut down ZOCP node
-            configManager.stop()
-            configManager = None
+            # the editor already knows the network, so the description is
+            # taken from the model; only writing the file happens in the
+            # background
+            description = describeNetwork(self.model)
+            self.startConfigWorker("Saving network...", writeDescription, fileName, description)
 
 
     def readNetwork(self):
@@ -153,34 +445,751 @@ class QNEMainWindow(QMainWindow):
                                                        filter="All files (*.*);;ZOCP (*.zocp);;JSON (*.json)",
                                                        selectedFilter="ZOCP (*.zocp)")
         if fileName:
-            # setup ZOCP node, and run it for some time to discover
-            # the current network
-            configManager = ZConfigManagerNode("ConfigManager@%s" % socket.gethostname())
-            configManager.discover(0.5)
-
-            # write network description to file
-            configManager.read(fileName)
-
-            # shut down ZOCP node
-            configManager.stop()
-            configManager = None
+            worker = self.startConfigWorker("Loading network...", readDescription, fileName)
+            if worker:
+                worker.completed.connect(self.restoreNetwork)
+
+
+    def startConfigWorker(self, label, task, *args):
+        if self.configWorker or self.restoreTimer.isActive():
+            QMessageBox.information(self, "ZOCP Node Editor",
+                "Please wait for the current save or load to finish.")
+            return None
+
+        worker = ZNEConfigWorker(self, task, *args)
+        progress = QProgressDialog(label, "Cancel", 0, 100, self)
+        progress.setMinimumDuration(250)
+        progress.setValue(0)
+        worker.progress.connect(progress.setValue)
+        progress.canceled.connect(worker.cancel)
+        worker.failed.connect(self.onConfigWorkerFailed)
+        worker.finished.connect(progress.reset)
+        worker.finished.connect(progress.deleteLater)
+        worker.finished.connect(self.onConfigWorkerFinished)
+
+        self.configWorker = worker
+        worker.start()
+
+        return worker
+
+
+    def onConfigWorkerFailed(self, message):
+        QMessageBox.warning(self, "ZOCP Node Editor", message)
+
+
+    def onConfigWorkerFinished(self):
+        self.configWorker.deleteLater()
+        self.configWorker = None
+
+
+    def restoreNetwork(self, description):
+        # only the differences between the description and the live network
+        # are sent, after the user has seen what will change
+        plan = planRestore(description, self.model)
+        if not plan:
+            QMessageBox.information(self, "ZOCP Node Editor",
+                "The network already matches the saved description.")
+            return
+
+        (summary, details) = describePlan(plan)
+        preview = QMessageBox(QMessageBox.Question, "Restore network", summary,
+            QMessageBox.Apply | QMessageBox.Cancel, self)
+        preview.setDetailedText(details)
+        if preview.exec_() != QMessageBox.Apply:
+            return
+
+        # zocp may only be used from the GUI thread, so the plan is sent a
+        # few peers at a time from a timer to keep the UI responsive
+        self.restorePlan = plan
+        self.restoreCount = len(self.restorePlan)
+
+        self.restoreProgress = QProgressDialog("Restoring network...", "Cancel",
+            0, self.restoreCount, self)
+        self.restoreProgress.setMinimumDuration(250)
+        self.restoreProgress.setValue(0)
+        self.restoreProgress.canceled.connect(self.cancelRestore)
+        self.restoreTimer.start()
+
+
+    def cancelRestore(self):
+        self.restorePlan = []
+
+
+    def onRestoreTimer(self):
+        batch = self.restorePlan[:self.restoreBatchSize]
+        self.restorePlan = self.restorePlan[self.restoreBatchSize:]
+        for step in batch:
+            peer = step.peer
+            if peer.hex not in self.model.peers:
+                # left the network in the meantime
+                continue
+            if step.values:
+                self.zocp.peer_set(peer.uuid, step.values)
+            for (recvPeer, receiver, emitter) in step.subscribe:
+                self.zocp.signal_subscribe(recvPeer.uuid, receiver, peer.uuid, emitter)
+            for (recvPeer, receiver, emitter) in step.unsubscribe:
+                self.zocp.signal_unsubscribe(recvPeer.uuid, receiver, peer.uuid, emitter)
+
+        if self.restorePlan:
+            self.restoreProgress.setValue(self.restoreCount - len(self.restorePlan))
+        else:
+            self.restoreTimer.stop()
+            self.restoreProgress.reset()
+            self.restoreProgress.deleteLater()
+            self.restoreProgress = None
 
 
     def zoomIn(self):
         if self.scale < 4:
             self.scale *= 1.2
             self.view.scale(1.2, 1.2)
+            self.nodesEditor.setScale(self.scale)
+            self.scheduleViewportUpdate()
 
 
     def zoomOut(self):
         if self.scale > 0.1:
             self.scale /= 1.2
             self.view.scale(1/1.2, 1/1.2)
+            self.nodesEditor.setScale(self.scale)
+            self.scheduleViewportUpdate()
 
 
     def zoomReset(self):
         self.scale = 1
         self.view.setTransform(QTransform())
+        self.nodesEditor.setScale(self.scale)
+        self.scheduleViewportUpdate()
+
+
+    def setFastRendering(self, enabled):
+        if enabled:
+            self.nodesEditor.setRenderProfile(QNEView.PerformanceProfile)
+        else:
+            self.nodesEditor.setRenderProfile(QNEView.QualityProfile)
+
+
+    def resizeEvent(self, event):
+        super(QNEMainWindow, self).resizeEvent(event)
+        self.scheduleViewportUpdate()
+
+
+    def scheduleViewportUpdate(self, *args):
+        # not restarted, so a steady stream of changes can not postpone
+        # the update indefinitely
+        if not self.viewportTimer.isActive():
+            self.viewportTimer.start()
+
+
+    def onViewportChanged(self):
+        self.updateGroups()
+        self.updateBlocks()
+        self.updateBundles()
+        self.updateViewportSubscriptions()
+
+
+    def editPeerFilter(self):
+        text, accepted = QInputDialog.getText(self, "Filter Peers",
+            "Only show peers whose name contains:", text=self.peerFilter)
+        if accepted:
+            self.setPeerFilter(text)
+
+
+    def setPeerFilter(self, text):
+        self.peerFilter = text.strip().lower()
+        self.groupsDirty = True
+        self.onViewportChanged()
+
+
+    def matchesFilter(self, peer):
+        return not self.peerFilter or self.peerFilter in peer.name.lower()
+
+
+    def isShown(self, peer):
+        # whether the peer gets its own block when in view
+        if not self.matchesFilter(peer):
+            return False
+        group = self.groupOf(peer)
+        return group is None or not self.collapsedGroups.get(group, True)
+
+
+    @QNEProfiler.timed("updateBlocks")
+    def updateBlocks(self):
+        enterRect = self.viewportRect(self.blockEnterMargin)
+        leaveRect = self.viewportRect(self.blockLeaveMargin)
+
+        for (uuid, node) in list(self.nodes.items()):
+            block = node["block"]
+            if not self.isShown(self.model.peers[uuid]):
+                self.dematerializePeer(uuid)
+            elif not block.isSelected() and not leaveRect.intersects(block.sceneBoundingRect()):
+                # selected blocks may be in the middle of a drag
+                self.dematerializePeer(uuid)
+
+        for (uuid, rect) in list(self.blockRects.items()):
+            if uuid not in self.nodes and enterRect.intersects(rect):
+                peer = self.model.peers[uuid]
+                if self.isShown(peer):
+                    self.materializePeer(peer)
+
+
+    def groupOf(self, peer):
+        if peer.hex in self.manualGroups:
+            return self.manualGroups[peer.hex]
+        if self.groupByHost and "@" in peer.name:
+            return peer.name.rsplit("@", 1)[1]
+        return None
+
+
+    def blockGroup(self, block):
+        peer = self.model.peer(block.uuid().hex)
+        return self.groupOf(peer) if peer else None
+
+
+    def setGroupByHost(self, enabled):
+        self.groupByHost = enabled
+        self.groupsDirty = True
+        self.onViewportChanged()
+
+
+    def setGroupCollapsed(self, group, collapsed):
+        self.collapsedGroups[group] = collapsed
+        self.groupsDirty = True
+        self.onViewportChanged()
+
+
+    def setAllGroupsCollapsed(self, collapsed):
+        for group in self.groupMembers:
+            self.collapsedGroups[group] = collapsed
+        self.groupsDirty = True
+        self.onViewportChanged()
+
+
+    def groupSelected(self):
+        blocks = [item for item in self.scene.selectedItems() if item.type() == QNEBlock.Type]
+        if not blocks:
+            return
+
+        group, accepted = QInputDialog.getText(self, "Group Peers", "Name of the group:")
+        group = group.strip()
+        if not accepted or not group:
+            return
+
+        for block in blocks:
+            self.manualGroups[block.uuid().hex] = group
+        self.setGroupCollapsed(group, True)
+
+
+    def ungroupSelected(self):
+        for item in self.scene.selectedItems():
+            if item.type() == QNEBlock.Type:
+                self.manualGroups.pop(item.uuid().hex, None)
+            elif item.type() == QNEGroupBlock.Type:
+                for uuid in self.groupMembers.get(item.name(), ()):
+                    self.manualGroups.pop(uuid, None)
+        self.groupsDirty = True
+        self.onViewportChanged()
+
+
+    @QNEProfiler.timed("updateGroups")
+    def updateGroups(self):
+        if not self.groupsDirty:
+            return
+        self.groupsDirty = False
+        self.bundlesDirty = True
+
+        members = {}
+        for peer in self.model.peers.values():
+            group = self.groupOf(peer)
+            if group is not None and peer.hex in self.blockRects:
+                members.setdefault(group, []).append(peer.hex)
+        self.groupMembers = members
+
+        for group in list(self.groupBlocks):
+            if group not in members or not self.collapsedGroups.get(group, True):
+                self.groupBlocks.pop(group).delete()
+
+        for (group, uuids) in members.items():
+            if not self.collapsedGroups.setdefault(group, True):
+                continue
+            if not any(self.matchesFilter(self.model.peers[uuid]) for uuid in uuids):
+                if group in self.groupBlocks:
+                    self.groupBlocks.pop(group).delete()
+                continue
+
+            block = self.groupBlocks.get(group)
+            if block is None:
+                block = QNEGroupBlock(None)
+                self.scene.addItem(block)
+                block.setNodeEditor(self)
+                block.setDetailLevel(self.nodesEditor.detailLevel())
+                block.setCacheMode(self.nodesEditor.blockCacheMode())
+                self.groupBlocks[group] = block
+            block.setGroup(group, len(uuids))
+
+            # placed in the middle of its members
+            rect = QRectF()
+            for uuid in uuids:
+                if uuid in self.nodes:
+                    rect = rect.united(self.sceneRect(self.nodes[uuid]["block"]))
+                else:
+                    rect = rect.united(self.blockRects[uuid])
+            block.setPos(rect.center())
+
+        self.updateGroupHighlights()
+
+
+    def clearBundles(self):
+        for bundle in self.bundles.values():
+            self.scene.removeItem(bundle)
+        self.bundles = {}
+
+
+    def bundleEnd(self, uuid, collapsed):
+        if uuid in collapsed:
+            return self.groupBlocks.get(collapsed[uuid])
+        if uuid in self.nodes:
+            return self.nodes[uuid]["block"]
+        return None
+
+
+    @QNEProfiler.timed("updateBundles")
+    def updateBundles(self):
+        if not self.bundlesDirty:
+            return
+        self.bundlesDirty = False
+
+        collapsed = {}
+        for (group, uuids) in self.groupMembers.items():
+            if group in self.groupBlocks:
+                for uuid in uuids:
+                    collapsed[uuid] = group
+        if not collapsed:
+            self.clearBundles()
+            return
+
+        # subscriptions between two plain blocks are drawn as connections,
+        # and those of peers without a block are out of view
+        counts = {}
+        ends = {}
+        for uuid in set(collapsed) | set(self.nodes):
+            source = self.bundleEnd(uuid, collapsed)
+            for capability in self.model.peers[uuid].capabilities.values():
+                for (recvPeer, receiver) in capability.subscribers:
+                    target = self.bundleEnd(recvPeer, collapsed)
+                    if target is None or target is source:
+                        continue
+                    if uuid not in collapsed and recvPeer not in collapsed:
+                        continue
+                    key = tuple(sorted((id(source), id(target))))
+                    counts[key] = counts.get(key, 0) + 1
+                    ends[key] = (source, target)
+
+        for key in list(self.bundles):
+            if key not in counts:
+                self.scene.removeItem(self.bundles.pop(key))
+        for (key, count) in counts.items():
+            bundle = self.bundles.get(key)
+            if bundle is None:
+                bundle = QNEBundle(None)
+                self.scene.addItem(bundle)
+                self.bundles[key] = bundle
+            bundle.setEnds(ends[key][0], ends[key][1], count)
+
+
+    def estimateBlockRect(self, peer):
+        # keeps the center of the known rect, if any
+        if peer.hex in self.blockRects:
+            center = self.blockRects[peer.hex].center()
+        elif "_zne_position" in peer.metadata:
+            position = peer.metadata["_zne_position"]
+            center = QPointF(position[0], position[1])
+        else:
+            center = QPointF(0, 0)
+
+        size = QNEBlock.estimateSize(self.scene.font(), peer.name, peer.capabilities.keys())
+        return QRectF(center.x() - size.width() / 2, center.y() - size.height() / 2,
+                      size.width(), size.height())
+
+
+    def materializePeer(self, peer):
+        block = QNEBlock(None)
+        self.scene.addItem(block)
+        block.setNodeEditor(self)
+        block.setName(peer.name)
+        block.setUuid(peer.uuid)
+        block.setDetailLevel(self.nodesEditor.detailLevel())
+        block.setCacheMode(self.nodesEditor.blockCacheMode())
+        block.addPort(peer.name, False, False, QNEPort.NamePort)
+        block.setPos(self.blockRects[peer.hex].center())
+        block.setHighlighted(peer.hex in self.searchMatches)
+        if peer.hex in self.portStates:
+            block.setPortState(self.portStates.pop(peer.hex))
+
+        node = {}
+        node["block"] = block
+        node["ports"] = dict()
+        self.nodes[peer.hex] = node
+
+        # creates the ports and their outgoing connections
+        self.onModelCapabilitiesAdded(peer, list(peer.capabilities.values()))
+
+        # incoming connections from emitters that already have a block
+        index = self.nodesEditor.connectionIndex
+        for (receiver, emitters) in self.model.subscriptionsTo(peer.hex).items():
+            if not block.hasPort(receiver):
+                continue
+            for (uuid, emitter) in emitters:
+                if uuid == peer.hex or uuid not in self.nodes:
+                    continue
+                port1 = self.nodes[uuid]["block"].outputEndpoint(emitter)
+                key = (uuid, emitter, peer.hex, receiver)
+                if port1 and key not in index:
+                    self.addConnection(port1, block.inputEndpoint(receiver), key)
+
+        # the connections of this peer are no longer external to its peers
+        self.updateExternalConnections(self.connectedPeers(peer))
+
+        self.nodesEditor.setBlockCount(len(self.nodes))
+        self.bundlesDirty = True
+
+
+    def dematerializePeer(self, uuid):
+        node = self.nodes.pop(uuid)
+        block = node["block"]
+        self.blockRects[uuid] = self.sceneRect(block)
+        self.portStates[uuid] = block.portState()
+        self.pendingSubscribers.discardPeer(uuid)
+        if self.viewportSubscriptions:
+            self.unsubscribePeer(uuid)
+
+        block.delete()
+        self.updateExternalConnections(self.connectedPeers(self.model.peers[uuid]))
+        self.nodesEditor.setBlockCount(len(self.nodes))
+        self.bundlesDirty = True
+
+
+    def sceneRect(self, block):
+        # without the margin for the shadow
+        return block.mapRectToScene(block.path().boundingRect())
+
+
+    def connectedPeers(self, peer):
+        # the peers that subscribe to, or are subscribed to by, a peer
+        peers = set()
+        for emitters in self.model.subscriptionsTo(peer.hex).values():
+            peers.update(emitPeer for (emitPeer, emitter) in emitters)
+        for capability in peer.capabilities.values():
+            peers.update(recvPeer for (recvPeer, receiver) in capability.subscribers)
+        peers.discard(peer.hex)
+
+        return peers
+
+
+    def updateExternalConnections(self, uuids):
+        # updates the markers of the ports of the blocks of these peers for
+        # connections to peers that have no block
+        for uuid in uuids:
+            if uuid in self.nodes:
+                for port in self.nodes[uuid]["ports"].values():
+                    self.updatePortExternalConnections(uuid, port)
+
+
+    def updatePortExternalConnections(self, uuid, port):
+        portname = port.portName()
+        inputs = 0
+        for (emitPeer, emitter) in self.model.subscriptionsTo(uuid).get(portname, ()):
+            if emitPeer not in self.nodes:
+                inputs += 1
+        outputs = 0
+        capability = self.model.capability(uuid, portname)
+        if capability is not None:
+            for (recvPeer, receiver) in capability.subscribers:
+                # subscriptions of peers that are gone, or of the editor
+                # itself, are not shown
+                if recvPeer not in self.nodes and recvPeer in self.model.peers:
+                    outputs += 1
+        port.setExternalConnections(inputs, outputs)
+
+
+    def viewportRect(self, margin):
+        rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        dx = rect.width() * margin
+        dy = rect.height() * margin
+        return rect.adjusted(-dx, -dy, dx, dy)
+
+
+    def setViewportSubscriptions(self, enabled):
+        self.viewportSubscriptions = enabled
+        if enabled:
+            self.updateViewportSubscriptions()
+        else:
+            for uuid in self.model.peers:
+                self.subscribePeer(uuid)
+
+
+    def updateViewportSubscriptions(self):
+        if not self.viewportSubscriptions:
+            return
+
+        enterRect = self.viewportRect(self.viewportEnterMargin)
+        leaveRect = self.viewportRect(self.viewportLeaveMargin)
+
+        # peers without a block are out of view, or filtered out; they were
+        # all subscribed if the mode was switched on after they entered
+        for uuid in list(self.signalSubscriptions):
+            block = self.nodes[uuid]["block"] if uuid in self.nodes else None
+            if block is None or not block.isVisible() or not leaveRect.intersects(block.sceneBoundingRect()):
+                self.unsubscribePeer(uuid)
+
+        for (uuid, node) in self.nodes.items():
+            block = node["block"]
+            if uuid in self.signalSubscriptions or not block.isVisible():
+                continue
+            if enterRect.intersects(block.sceneBoundingRect()):
+                self.subscribePeer(uuid)
+
+
+    def subscribePeer(self, uuid):
+        if uuid in self.signalSubscriptions or uuid not in self.model.peers:
+            return
+
+        # Subscribe to any and all value changes
+        self.signalSubscriptions.add(uuid)
+        self.zocp.signal_subscribe(self.zocp.uuid(), None, self.model.peers[uuid].uuid, None)
+
+
+    def unsubscribePeer(self, uuid):
+        if uuid not in self.signalSubscriptions:
+            return
+
+        self.signalSubscriptions.discard(uuid)
+        if uuid in self.model.peers:
+            self.zocp.signal_unsubscribe(self.zocp.uuid(), None, self.model.peers[uuid].uuid, None)
+
+
+    def setValueUpdateRate(self, rate):
+        self.valueUpdateRate = rate
+        self.valueTimer.setInterval(int(1000 / rate))
+
+
+    @QNEProfiler.timed("flushValues")
+    def flushValues(self):
+        if not self.dirtyValues:
+            # nothing changed since the last tick, so stop ticking until
+            # the next signal comes in
+            self.valueTimer.stop()
+            return
+
+        dirtyValues = self.dirtyValues
+        self.dirtyValues = set()
+        for (uuid, portname) in dirtyValues:
+            capability = self.model.capability(uuid, portname)
+            if capability and uuid in self.nodes and portname in self.nodes[uuid]["ports"]:
+                port = self.nodes[uuid]["ports"][portname]
+                port.setValue(str(capability.value))
+                if capability.history is not None:
+                    port.updateHistory()
+
+
+    def initProfilerOverlay(self):
+        self.profilerOverlay = QLabel(self.view.viewport())
+        font = QFont("Monospace")
+        font.setStyleHint(QFont.TypeWriter)
+        self.profilerOverlay.setFont(font)
+        self.profilerOverlay.setStyleSheet(
+            "QLabel { background-color: rgba(0, 0, 0, 160); color: white; padding: 4px; }")
+        self.profilerOverlay.move(8, 8)
+        self.profilerOverlay.setVisible(False)
+
+        self.profilerTimer = QTimer(self)
+        self.profilerTimer.setInterval(500)
+        self.profilerTimer.timeout.connect(self.updateProfilerOverlay)
+
+
+    def setProfilerOverlayVisible(self, visible):
+        QNEProfiler.setEnabled(visible)
+        self.profilerOverlay.setVisible(visible)
+        if visible:
+            self.updateProfilerOverlay()
+            self.profilerTimer.start()
+        else:
+            self.profilerTimer.stop()
+
+
+    def profilerCounters(self):
+        return {
+            "peers": len(self.model.peers),
+            "blocks": len(self.nodes),
+            "connections": len(self.nodesEditor.connectionIndex),
+            "valueUpdatesReceived": self.valueUpdatesReceived,
+            "valueUpdatesDropped": self.valueUpdatesDropped,
+            "histories": self.model.historyCount,
+            "capabilityUpdatesApplied": self.model.updatesApplied,
+            "capabilityUpdatesSkipped": self.model.updatesSkipped,
+            "groups": len(self.groupMembers),
+            "bundles": len(self.bundles),
+            "searchEntries": len(self.searchIndex),
+            "pendingSubscribers": len(self.pendingSubscribers),
+            "pendingSubscribersResolved": self.pendingSubscribers.resolvedCount,
+            "pendingSubscribersExpired": self.pendingSubscribers.expiredCount,
+        }
+
+
+    def updateProfilerOverlay(self):
+        counters = self.profilerCounters()
+        lines = [QNEProfiler.report(), ""]
+        for name in sorted(counters):
+            lines.append("%-32s %8d" % (name, counters[name]))
+
+        self.profilerOverlay.setText("\n".join(lines))
+        self.profilerOverlay.adjustSize()
+
+
+    def exportProfile(self):
+        fileName, filter = QFileDialog.getSaveFileName(self,
+                                                       caption="Export performance data",
+                                                       filter="JSON (*.json)",
+                                                       selectedFilter="JSON (*.json)")
+        if fileName:
+            QNEProfiler.export(fileName, {"counters": self.profilerCounters()})
+
+
+    def setRecording(self, enabled):
+        if self.recorder:
+            self.recorder.stop()
+            self.statusBar().showMessage("Recorded %d events" % self.recorder.eventCount, 5000)
+            self.recorder.deleteLater()
+            self.recorder = None
+
+        if enabled:
+            fileName = None
+            if not self.replay:
+                fileName, filter = QFileDialog.getSaveFileName(self,
+                                                               caption="Record events to",
+                                                               filter="ZNE recording (*.znerec)",
+                                                               selectedFilter="ZNE recording (*.znerec)")
+            if fileName:
+                self.recorder = ZNERecorder(self, fileName)
+                self.recorder.failed.connect(self.onRecorderFailed)
+                self.recorder.start()
+
+        self.recordAct.setChecked(self.recorder is not None)
+
+
+    def onRecorderFailed(self, message):
+        QMessageBox.warning(self, "ZOCP Node Editor", message)
+        self.setRecording(False)
+
+
+    def startReplay(self, realTime):
+        if self.replay:
+            return
+
+        fileName, filter = QFileDialog.getOpenFileName(self,
+                                                       caption="Replay",
+                                                       filter="ZNE recording (*.znerec);;All files (*.*)",
+                                                       selectedFilter="ZNE recording (*.znerec)")
+        if not fileName:
+            return
+
+        try:
+            self.replay = ZNEReplay(self, fileName, self.onReplayEvent, realTime)
+        except (IOError, OSError, ValueError) as e:
+            QMessageBox.warning(self, "ZOCP Node Editor", str(e))
+            return
+
+        # the live network is set aside while replaying; its events are
+        # left queued in the ZOCP inbox and nothing is sent to it
+        self.setRecording(False)
+        self.flushPositions()
+        self.notifier.setEnabled(False)
+        self.clearView()
+        self.model.removeListener(self)
+        self.liveState = (self.model, self.signalSubscriptions, self.zocp, self.manualGroups)
+        self.model = ZNENetworkModel()
+        self.manualGroups = {}
+        self.model.addListener(self)
+        self.signalSubscriptions = set()
+        self.zocp = ZNEMutedZOCP(self.zocp)
+
+        self.setWindowTitle("ZOCP Node Editor - replaying %s" % fileName)
+        self.stopReplayAct.setEnabled(True)
+        self.replay.finished.connect(self.onReplayFinished)
+        self.replay.start()
+
+
+    def stopReplay(self):
+        if self.replay and self.replay.isActive():
+            self.replay.stop()
+
+
+    def onReplayEvent(self, kind, peer, name, data):
+        if kind == PeerEnter:
+            self.onPeerEnter(peer, name)
+        elif kind == PeerExit:
+            self.onPeerExit(peer, name)
+        elif kind == PeerModified:
+            self.onPeerModified(peer, name, data)
+        elif kind == PeerSignaled:
+            self.onPeerSignaled(peer, name, data)
+
+
+    def onReplayFinished(self):
+        message = "Replayed %d events" % self.replay.eventCount
+        if self.replay.skippedCount:
+            message += ", skipped %d damaged records" % self.replay.skippedCount
+        self.statusBar().showMessage(message, 5000)
+        self.replay.deleteLater()
+        self.replay = None
+
+        self.clearView()
+        self.model.removeListener(self)
+        (self.model, self.signalSubscriptions, self.zocp, self.manualGroups) = self.liveState
+        self.liveState = None
+        self.model.addListener(self)
+        self.rebuildView()
+
+        self.setWindowTitle("ZOCP Node Editor")
+        self.stopReplayAct.setEnabled(False)
+        self.notifier.setEnabled(True)
+        # the notifier is edge-triggered, so drain what queued up meanwhile
+        self.onZOCPEvent()
+        self.scheduleViewportUpdate()
+
+
+    def clearView(self):
+        # removes the blocks without forgetting the peers, as
+        # onModelPeerRemoved would; manual groups are kept with the model
+        for uuid in list(self.nodes):
+            self.nodes.pop(uuid)["block"].delete()
+        self.nodesEditor.setBlockCount(0)
+        self.blockRects = {}
+        self.portStates = {}
+        for block in self.groupBlocks.values():
+            block.delete()
+        self.groupBlocks = {}
+        self.groupMembers = {}
+        self.clearBundles()
+        self.groupsDirty = True
+        self.searchIndex.clear()
+        self.setSearchMatches(set())
+        self.pendingSubscribers.clear()
+        self.pendingPositions = {}
+        self.sentPositions = {}
+        self.pendingEdits = set()
+        self.dirtyValues = set()
+
+
+    def rebuildView(self):
+        # blocks are created for the peers in view once the rects of all
+        # peers are known
+        for peer in self.model.peers.values():
+            self.indexPeer(peer)
+            if peer.capabilities:
+                self.blockRects[peer.hex] = self.estimateBlockRect(peer)
+        self.updateBlocks()
+        self.onSearchIndexChanged()
 
 
     def about(self):
@@ -217,6 +1226,9 @@ class QNEMainWindow(QMainWindow):
         emit_peer = fromBlock.uuid()
         receiver = toPort.portName()
         recv_peer = toBlock.uuid()
+        if connection.key():
+            # either end may be a stub, which has no port name
+            (emitter, receiver) = (connection.key()[1], connection.key()[3])
 
         self.zocp.signal_unsubscribe(recv_peer, receiver, emit_peer, emitter)
 
@@ -225,52 +1237,61 @@ class QNEMainWindow(QMainWindow):
 
 
     def onBlockMoved(self, block):
+        self.bundlesDirty = True
+        self.scheduleViewportUpdate()
+
         pos = block.pos()
+        self.pendingPositions[block.uuid().hex] = [pos.x(), pos.y()]
+        self.blockRects[block.uuid().hex] = self.sceneRect(block)
+
+        if self.positionSyncInterval > 0:
+            if not self.positionTimer.isActive():
+                self.positionTimer.start(self.positionSyncInterval)
+        else:
+            # restarting the timer debounces consecutive moves
+            self.positionTimer.start(self.positionSyncDelay)
+
+
+    def flushPositions(self):
+        pendingPositions = self.pendingPositions
+        self.pendingPositions = {}
+        for (uuid, position) in pendingPositions.items():
+            peer = self.model.peer(uuid)
+            if peer is None or peer.metadata.get("_zne_position") == position:
+                continue
+
+            # remember what was sent, so the echo can be recognized
+            self.sentPositions[uuid] = position
+            self.zocp.peer_set(peer.uuid, {"_zne_position": position})
+
+
+    def setPortHistory(self, block, port, enabled):
         peer = block.uuid()
-        self.zocp.peer_set(peer, {"_zne_position": [pos.x(), pos.y()]})
+        if self.model.setHistoryEnabled(peer.hex, port.portName(), enabled):
+            port.setHistory(self.model.capability(peer.hex, port.portName()).history)
+        else:
+            port.setHistory(None)
+            if enabled:
+                # not numeric, or the limit on histories is reached
+                self.statusBar().showMessage("No history can be kept for %s" % port.portName(), 5000)
 
 
     def onChangeValue(self, block, port, value):
         self.logger.debug("block %s port %s changed to %s" % (block.name(), port.portName(), value))
         peer = block.uuid()
         portName = port.portName()
-        capability = self.zocp.peers_capabilities[peer][portName]
-        typeHint = capability["typeHint"]
-        validValue = True
-        if typeHint == "int":
-            try:
-                value = int(float(value))
-            except:
-                validValue = False
-        elif typeHint == "flt":
-            try:
-                value = float(value.strip())
-            except:
-                validValue = False
-        elif typeHint == "percent":
-            try:
-                value = float(value.strip())
-            except:
-                validValue = False
-        elif typeHint == "bool":
-            value = (value.strip().lower() in ["true", "yes", "1"])
-        elif typeHint == "string":
-            pass
-        elif typeHint.startswith("vec" ) and typeHint.endswith("f") and len(typeHint) == 5:
-            try:
-                value = [float(num) for num in ((value.strip())[1:-1]).split(",")]
-            except:
-                validValue = False
-
-            if validValue:
-                if len(value) != int(typeHint[3]):
-                    validValue = False
+        capability = self.model.capability(peer.hex, portName)
+        (validValue, value) = parseValue(capability.typeHint, value)
 
+        # a signaled value that has not been shown yet is older than this one
+        self.dirtyValues.discard((peer.hex, portName))
         if validValue:
             self.zocp.peer_set(peer, {portName: {"value": value}})
             port.setValue(str(value))
+            # shown until the peer answers; see onPeerModified
+            self.pendingEdits.add((peer.hex, portName))
         else:
-            port.setValue(str(capability["value"]))
+            port.setValue(str(capability.value))
 
 
 
@@ -278,6 +1299,12 @@ class QNEMainWindow(QMainWindow):
     # ZOCP implementation
     #########################################
     def initZOCP(self):
+        # budget per notifier activation; when it runs out, draining
+        # continues in the next event loop iteration
+        self.zocpEventBudget = 0.02
+        self.zocpEventMaxMessages = 200
+        self.zocpDrainScheduled = False
+
         self.zocp = ZOCP("ZOCP Node Editor@%s" % socket.gethostname())
         self.notifier = QSocketNotifier(
             self.zocp.inbox.getsockopt(zmq.FD),
@@ -294,142 +1321,290 @@ class QNEMainWindow(QMainWindow):
         zl.setLevel(logging.INFO)
 
 
-    def onZOCPEvent(self):
-        self.zocp.run_once(0)
+    @QNEProfiler.timed("onZOCPEvent")
+    def onZOCPEvent(self, *args):
+        self.zocpDrainScheduled = False
+        if self.replay:
+            # live events wait until the replay is done
+            return
 
+        # the zmq FD is edge-triggered, so keep reading until the socket
+        # reports no more pending messages or the budget is used up
+        deadline = time.time() + self.zocpEventBudget
+        count = 0
+        while self.zocp.inbox.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            if count >= self.zocpEventMaxMessages or time.time() > deadline:
+                if not self.zocpDrainScheduled:
+                    self.zocpDrainScheduled = True
+                    QTimer.singleShot(0, self.onZOCPEvent)
+                return
 
-    def onPeerEnter(self, peer, name, *args, **kwargs):
-        # Subscribe to any and all value changes
-        self.zocp.signal_subscribe(self.zocp.uuid(), None, peer, None)
+            self.zocp.run_once(0)
+            count += 1
 
-        # Add named block; ports are not known at this point
-        block = QNEBlock(None)
-        self.scene.addItem(block)
-        block.setNodeEditor(self)
-        block.setName(name)
-        block.setUuid(peer)
-        block.addPort(name, False, False, QNEPort.NamePort)
-        block.setVisible(False)
-
-        node = {}
-        node["block"] = block
-        node["ports"] = dict()
 
-        self.nodes[peer.hex] = node
+    @QNEProfiler.timed("onPeerEnter")
+    def onPeerEnter(self, peer, name, *args, **kwargs):
+        if self.recorder:
+            self.recorder.record(PeerEnter, peer, name)
+        self.model.peerEnter(peer, name)
+        if self.searchIndex.addPeer(peer.hex, name):
+            self.onSearchIndexChanged()
+
+        if self.viewportSubscriptions:
+            # the block is placed once its capabilities are known
+            self.scheduleViewportUpdate()
+        else:
+            self.subscribePeer(peer.hex)
 
 
+    @QNEProfiler.timed("onPeerExit")
     def onPeerExit(self, peer, name, *args, **kwargs):
+        if self.recorder:
+            self.recorder.record(PeerExit, peer, name)
+
         # Unsubscribe from value changes
-        self.zocp.signal_unsubscribe(self.zocp.uuid(), None, peer, None)
+        self.unsubscribePeer(peer.hex)
 
-        # Remove block
-        if peer.hex in self.nodes:
-            self.nodes[peer.hex]["block"].delete()
-            self.nodes.pop(peer.hex)
+        self.model.peerExit(peer)
+        if self.searchIndex.removePeer(peer.hex):
+            self.onSearchIndexChanged()
 
 
+    @QNEProfiler.timed("onPeerModified")
     def onPeerModified(self, peer, name, data, *args, **kwargs):
-        for portname in data:
-            portdata = data[portname]
-
-            if portname not in self.nodes[peer.hex]["ports"]:
-                if "access" in portdata:
-                    hasInput = "s" in portdata["access"]
-                    hasOutput = "e" in portdata["access"]
-                    port = self.nodes[peer.hex]["block"].addPort(portname, hasInput, hasOutput)
-                    port.setValue(str(portdata["value"]))
-                    port.setAccess(str(portdata["access"]))
-                    self.nodes[peer.hex]["ports"][portname] = port
-
-                else:
-                    # Metadata, not a capability
-                    if portname == "_zne_position":
-                        block = self.nodes[peer.hex]["block"]
-                        block.setPos(portdata[0], portdata[1])
-
-            else:
-                port = self.nodes[peer.hex]["ports"][portname]
-                if "value" in portdata:
-                    port.setValue(str(portdata["value"]))
-                if "access" in portdata:
-                    port.setAccess(str(portdata["access"]))
-
-            if "subscribers" in portdata:
-                self.updateSubscribers(port, portdata["subscribers"])
-
-        if len(self.nodes[peer.hex]["ports"]) > 0:
-            self.nodes[peer.hex]["block"].setVisible(True)
-        self.updatePendingSubscribers(peer)
-
-
+        if self.recorder:
+            self.recorder.record(PeerModified, peer, name, data)
+        self.model.peerModified(peer, data)
+
+        # unchanged texts are skipped by the index
+        modelPeer = self.model.peer(peer.hex)
+        if modelPeer:
+            indexChanged = False
+            for portname in data:
+                capability = modelPeer.capabilities.get(portname)
+                if capability is not None:
+                    if self.searchIndex.updatePort(peer.hex, portname, capability.value):
+                        indexChanged = True
+
+                # the model skips a value that did not change, so an edit
+                # the peer rejected is reverted here
+                if (peer.hex, portname) in self.pendingEdits:
+                    self.pendingEdits.discard((peer.hex, portname))
+                    if capability is not None and peer.hex in self.nodes:
+                        port = self.nodes[peer.hex]["ports"].get(portname)
+                        if port is not None:
+                            port.setValue(str(capability.value))
+
+            # ports the peer no longer has
+            ports = self.searchIndex.ports(peer.hex)
+            if len(ports) != len(modelPeer.capabilities):
+                for portname in list(ports):
+                    if portname not in modelPeer.capabilities:
+                        self.searchIndex.removePort(peer.hex, portname)
+                        indexChanged = True
+
+            if indexChanged:
+                self.onSearchIndexChanged()
+
+
+    @QNEProfiler.timed("onPeerSignaled")
     def onPeerSignaled(self, peer, name, data, *args, **kwargs):
+        if self.recorder:
+            self.recorder.record(PeerSignaled, peer, name, data)
         [portname, value] = data
-        if portname in self.nodes[peer.hex]["ports"]:
-            self.nodes[peer.hex]["ports"][portname].setValue(str(value))
+        self.model.peerSignaled(peer, portname, value)
+
+
+    #########################################
+    # Network model callbacks
+    #########################################
+    def onModelPeerRemoved(self, peer):
+        # Remove block
+        self.pendingSubscribers.discardPeer(peer.hex)
+        if peer.hex in self.blockRects and self.groupOf(peer) is not None:
+            # its group loses a member
+            self.groupsDirty = True
+        self.blockRects.pop(peer.hex, None)
+        self.portStates.pop(peer.hex, None)
+        self.manualGroups.pop(peer.hex, None)
+        self.pendingPositions.pop(peer.hex, None)
+        self.sentPositions.pop(peer.hex, None)
+        self.pendingEdits = set(key for key in self.pendingEdits if key[0] != peer.hex)
+        self.scheduleViewportUpdate()
+        if peer.hex in self.nodes:
+            self.nodes[peer.hex]["block"].delete()
+            self.nodes.pop(peer.hex)
+            self.nodesEditor.setBlockCount(len(self.nodes))
+        self.updateExternalConnections(self.connectedPeers(peer))
+
+
+    def onModelCapabilitiesAdded(self, peer, capabilities):
+        if peer.hex not in self.nodes:
+            # no block yet, so only its estimated size changes; the peer
+            # may have come into view, or be a new member of its group
+            if peer.hex not in self.blockRects and self.groupOf(peer) is not None:
+                self.groupsDirty = True
+            self.blockRects[peer.hex] = self.estimateBlockRect(peer)
+            self.scheduleViewportUpdate()
+            return
+        node = self.nodes[peer.hex]
+
+        # ports are bound to the visible slice of the capabilities; values
+        # are set as they are bound, see onBindPort
+        block = node["block"]
+        specs = [(capability.name, capability.canSet(), capability.canEmit())
+            for capability in capabilities]
+        block.addVirtualPorts(specs)
+
+        for capability in capabilities:
+            if capability.subscribers:
+                self.updateSubscribers(block, capability.name, capability.subscribers)
+
+        # connect emitters that were waiting for these ports
+        index = self.nodesEditor.connectionIndex
+        for capability in capabilities:
+            receiver = capability.name
+            for (emitPeer, emitter) in self.pendingSubscribers.resolve((peer.hex, receiver)):
+                if emitPeer not in self.nodes:
+                    continue
+                port1 = self.nodes[emitPeer]["block"].outputEndpoint(emitter)
+                key = (emitPeer, emitter, peer.hex, receiver)
+                if port1 and key not in index:
+                    self.addConnection(port1, block.inputEndpoint(receiver), key)
+
+
+    def onBindPort(self, block, port):
+        hex = block.uuid().hex
+        capability = self.model.capability(hex, port.portName())
+        port.setValue(str(capability.value))
+        port.setAccess(capability.access)
+        if capability.history is not None:
+            port.setHistory(capability.history)
+        self.nodes[hex]["ports"][capability.name] = port
+        self.updatePortExternalConnections(hex, port)
+
+
+    def onUnbindPort(self, block, port, name):
+        self.nodes[block.uuid().hex]["ports"].pop(name, None)
+
+
+    def onModelCapabilityChanged(self, peer, capability, fields):
+        if "subscribers" in fields:
+            self.bundlesDirty = True
+            self.scheduleViewportUpdate()
+        if peer.hex not in self.nodes:
+            return
+        node = self.nodes[peer.hex]
+        # ports that are not bound get their state when they are
+        port = node["ports"].get(capability.name)
+        if port is not None:
+            if "value" in fields:
+                self.dirtyValues.discard((peer.hex, capability.name))
+                port.setValue(str(capability.value))
+            if "access" in fields:
+                port.setAccess(capability.access)
+        if "subscribers" in fields:
+            self.updateSubscribers(node["block"], capability.name, capability.subscribers)
+
+
+    def onModelSubscribersChanged(self, peer, capability, old):
+        uuids = set(recvPeer for (recvPeer, receiver) in old ^ capability.subscribers)
+        uuids.add(peer.hex)
+        self.updateExternalConnections(uuids)
+
+
+    def onModelMetadataChanged(self, peer, name, value):
+        if name == "_zne_position":
+            if self.sentPositions.pop(peer.hex, None) == value:
+                # echo of our own update; the block is already there
+                return
+            if peer.hex in self.pendingPositions:
+                # moved locally since; the local position wins
+                return
+
+            if peer.hex in self.nodes:
+                self.nodes[peer.hex]["block"].setPos(value[0], value[1])
+                self.bundlesDirty = True
+            elif peer.hex in self.blockRects:
+                self.blockRects[peer.hex].moveCenter(QPointF(value[0], value[1]))
+                if self.groupOf(peer) is not None:
+                    # group blocks are placed in the middle of their members
+                    self.groupsDirty = True
+            self.scheduleViewportUpdate()
+
+
+    def onModelValueSignaled(self, peer, capability):
+        key = (peer.hex, capability.name)
+        self.valueUpdatesReceived += 1
+        if key in self.dirtyValues:
+            # the previous value was never shown
+            self.valueUpdatesDropped += 1
+        else:
+            self.dirtyValues.add(key)
+        if not self.valueTimer.isActive():
+            self.valueTimer.start()
 
 
-    def updateSubscribers(self, port, subscribers):
-        port1 = port.outputPort
+    def updateSubscribers(self, block, emitter, subscribers):
+        port1 = block.outputEndpoint(emitter)
+        if port1 is None:
+            # not an emitter, so there is nothing to connect
+            return
+        emitPeer = block.uuid().hex
+        index = self.nodesEditor.connectionIndex
 
-        # check if any current connections should be removed
-        connections = port.connections()
-        for connection in connections:
-            if(connection.port1() == port1):
-                port2 = connection.port2()
-            else:
-                port2 = connection.port1()
+        current = index.subscribers(emitPeer, emitter)
+        wanted = set(subscribers)
+        self.pendingSubscribers.discardEmitter((emitPeer, emitter), wanted)
 
-            if not port2.isOutput():
-                subscriber = [port2.block().uuid().hex, port2.portName()]
-                if subscriber not in subscribers:
-                    connection.delete()
-                    self.logger.debug("peer removed subscription from %s on %s to %s on %s" %
-                        (port1.portName(), port1.block().name(), port2.portName(), port2.block().name()))
+        # remove connections for subscriptions that were dropped
+        for (uuid, portname) in current - wanted:
+            index.connection(emitPeer, emitter, uuid, portname).delete()
+            self.logger.debug("peer removed subscription from %s on %s to %s on %s" %
+                (emitter, block.name(), portname, self.model.peers[uuid].name))
 
         # add new connections for new subscriptions
-        for subscriber in subscribers:
-            [uuid, portname] = subscriber
+        for (uuid, portname) in wanted - current:
             if uuid in self.nodes:
-                node = self.nodes[uuid]
-                if portname in node["ports"]:
-                    port2 = node["ports"][portname]
-                    if not port2.isConnected(port1):
-                        # create new connection
-                        connection = QNEConnection(None)
-                        connection.setPort1(port1)
-                        connection.setPort2(port2)
-                        connection.updatePosFromPorts()
-                        connection.updatePath()
-                        self.scene.addItem(connection)
-                        self.logger.debug("peer added subscription from %s on %s to %s on %s" %
-                            (port1.portName(), port1.block().name(), port2.portName(), port2.block().name()))
+                block2 = self.nodes[uuid]["block"]
+                if block2.hasPort(portname):
+                    self.addConnection(port1, block2.inputEndpoint(portname),
+                        (emitPeer, emitter, uuid, portname))
+                    self.logger.debug("peer added subscription from %s on %s to %s on %s" %
+                        (emitter, block.name(), portname, block2.name()))
                     continue
-
-            # if the connection could not be made yet, add it to a list of
-            # pending subscriber-connections
-            if uuid not in self.pendingSubscribers:
-                self.pendingSubscribers[uuid] = []
-            self.pendingSubscribers[uuid].append([port1, portname])
-
-
-    def updatePendingSubscribers(self, peer):
-        if peer.hex in self.pendingSubscribers:
-            for subscriber in self.pendingSubscribers[peer.hex]:
-                [port1, portname] = subscriber
-                if peer.hex in self.nodes and portname in self.nodes[peer.hex]["ports"]:
-                    port2 = self.nodes[peer.hex]["ports"][portname]
-
-                    connection = QNEConnection(None)
-                    connection.setPort1(port1)
-                    connection.setPort2(port2)
-                    connection.updatePosFromPorts()
-                    connection.updatePath()
-                    self.scene.addItem(connection)
-                else:
-                    # TODO: handle case where port is still not available
-                    pass
-
-            self.pendingSubscribers.pop(peer.hex)
+            elif uuid in self.model.peers and portname in self.model.peers[uuid].capabilities:
+                # connected when a block is created for the receiver
+                continue
+
+            # the receiving port does not exist yet; it is connected when
+            # it is created, unless the subscription expires first
+            self.pendingSubscribers.add((emitPeer, emitter), (uuid, portname), time.time())
+            if not self.pendingTimer.isActive():
+                self.pendingTimer.start()
+
+
+    def expirePendingSubscribers(self):
+        expired = self.pendingSubscribers.expire(time.time())
+        if expired:
+            self.logger.debug("%d pending subscriptions expired" % expired)
+        if self.pendingSubscribers.isEmpty():
+            self.pendingTimer.stop()
+
+
+    def addConnection(self, port1, port2, key):
+        # key is (emit peer, emitter, recv peer, receiver); either end may
+        # be the stub of a port that is not shown
+        connection = QNEConnection(None)
+        connection.setPort1(port1)
+        connection.setPort2(port2)
+        connection.updatePosFromPorts()
+        connection.updatePath()
+        self.scene.addItem(connection)
+        self.nodesEditor.connectionIndex.add(connection, key)
+
+        return connection
 
 
 if __name__ == '__main__':
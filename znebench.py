@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+
+# Load benchmark for the node editor. Starts a number of simulated ZOCP
+# peers as local subprocesses, drives a QNEMainWindow against them and
+# writes the measurements to a JSON file.
+#
+#   python3 znebench.py --peers 50 --ports 20 --rate 60 --duration 30
+
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+typeHints = ["int", "flt", "percent", "bool", "vec3f"]
+topologies = ["none", "chain", "star"]
+
+
+#########################################
+# Simulated peer
+#########################################
+def peerName(index):
+    return "znebench-%d@%s" % (index, socket.gethostname())
+
+
+def runPeer(config):
+    from zocp import ZOCP
+
+    node = ZOCP(peerName(config["index"]))
+
+    outputs = []
+    for i in range(config["ports"]):
+        typeHint = config["typeHints"][i % len(config["typeHints"])]
+        name = "out%d" % i
+        if typeHint == "int":
+            node.register_int(name, 0, access="re")
+        elif typeHint == "flt":
+            node.register_float(name, 0.0, access="re")
+        elif typeHint == "percent":
+            node.register_percent(name, 0.0, access="re")
+        elif typeHint == "bool":
+            node.register_bool(name, False, access="re")
+        elif typeHint == "vec3f":
+            node.register_vec3f(name, [0.0, 0.0, 0.0], access="re")
+        node.register_float("in%d" % i, 0.0, access="rws")
+        outputs.append((name, typeHint))
+
+    # subscribe the inputs of this peer to the outputs of the peers it
+    # listens to according to the topology
+    sources = []
+    if config["topology"] == "chain" and config["index"] > 0:
+        sources.append(peerName(config["index"] - 1))
+    elif config["topology"] == "star" and config["index"] == 0:
+        sources.extend(peerName(index) for index in range(1, config["peers"]))
+
+    def onPeerEnter(peer, name, *args, **kwargs):
+        if name in sources:
+            for i in range(config["ports"]):
+                node.signal_subscribe(node.uuid(), "in%d" % i, peer, "out%d" % i)
+    node.on_peer_enter = onPeerEnter
+
+    node.start()
+
+    interval = 1.0 / config["rate"] if config["rate"] > 0 else None
+    end = time.time() + config["duration"]
+    nextEmit = time.time() + config["delay"]
+    count = 0
+    try:
+        while time.time() < end:
+            now = time.time()
+            if interval is None or now < nextEmit:
+                timeout = 100 if interval is None else (nextEmit - now) * 1000
+                node.run_once(max(0, int(timeout)))
+                continue
+
+            for (name, typeHint) in outputs:
+                node.emit_signal(name, signalValue(typeHint, count))
+            count += 1
+            nextEmit += interval
+            if nextEmit < now:
+                # running behind; skip rather than burst
+                nextEmit = now + interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.stop()
+
+
+def signalValue(typeHint, count):
+    if typeHint == "int":
+        return count
+    elif typeHint == "flt":
+        return math.sin(count * 0.1)
+    elif typeHint == "percent":
+        return (count % 100) / 100.0
+    elif typeHint == "bool":
+        return count % 2 == 0
+    elif typeHint == "vec3f":
+        return [math.sin(count * 0.1), math.cos(count * 0.1), 0.0]
+    return count
+
+
+#########################################
+# Benchmark driver
+#########################################
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def runBenchmark(options):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from PySide.QtCore import QTimer
+    from PySide.QtGui import QApplication
+    from zne import QNEMainWindow
+
+    app = QApplication(sys.argv)
+    window = QNEMainWindow(None)
+    window.show()
+
+    processes = []
+    for index in range(options.peers):
+        config = {
+            "index": index,
+            "peers": options.peers,
+            "ports": options.ports,
+            "typeHints": options.types.split(","),
+            "topology": options.topology,
+            "rate": options.rate,
+            "delay": options.warmup,
+            "duration": options.warmup + options.duration + 5,
+        }
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__),
+            "--peer", json.dumps(config)]))
+
+    results = {
+        "timestamp": time.time(),
+        "host": socket.gethostname(),
+        "parameters": vars(options),
+    }
+    state = {
+        "start": time.time(),
+        "modelPopulated": None,
+        "populated": None,
+        "received": 0,
+        "dropped": 0,
+        "measureStart": None,
+        "latency": [],
+        "lastProbe": None,
+    }
+    names = set(peerName(index) for index in range(options.peers))
+    # every simulated peer has an output and an input per port
+    expectedPorts = 2 * options.ports
+
+    def checkPopulated():
+        peers = [peer for peer in window.model.peers.values() if peer.name in names]
+        if state["modelPopulated"] is None:
+            if len(peers) < len(names):
+                return
+            for peer in peers:
+                if len(peer.capabilities) < expectedPorts:
+                    return
+            state["modelPopulated"] = time.time() - state["start"]
+
+        # blocks are only created for the peers in view, once the view
+        # has caught up with the model
+        enterRect = window.viewportRect(window.blockEnterMargin)
+        for peer in peers:
+            rect = window.blockRects.get(peer.hex)
+            if rect is None or peer.hex in window.nodes or not window.isShown(peer):
+                continue
+            if enterRect.intersects(rect):
+                return
+
+        state["populated"] = time.time() - state["start"]
+        populateTimer.stop()
+
+    def probe():
+        # the probe fires every 10ms; anything beyond that is time the
+        # event loop was busy elsewhere
+        now = time.time()
+        if state["lastProbe"] is not None and state["measureStart"] is not None:
+            state["latency"].append(max(0.0, now - state["lastProbe"] - 0.01))
+        state["lastProbe"] = now
+
+    def startMeasuring():
+        state["measureStart"] = time.time()
+        state["received"] = window.valueUpdatesReceived
+        state["dropped"] = window.valueUpdatesDropped
+
+    def finish():
+        elapsed = time.time() - state["measureStart"]
+        received = window.valueUpdatesReceived - state["received"]
+        dropped = window.valueUpdatesDropped - state["dropped"]
+        latency = state["latency"]
+
+        # the model holds all peers at modelPopulateTime, the blocks in
+        # view exist at populateTime
+        results["modelPopulateTime"] = state["modelPopulated"]
+        results["populateTime"] = state["populated"]
+        results["blocks"] = len(window.nodes)
+        results["signalsReceived"] = received
+        results["signalsPerSecond"] = received / elapsed if elapsed > 0 else 0
+        results["updatesDropped"] = dropped
+        results["updatesShown"] = received - dropped
+        results["eventLoopLatency"] = {
+            "mean": sum(latency) / len(latency) if latency else 0,
+            "p50": percentile(latency, 0.5),
+            "p95": percentile(latency, 0.95),
+            "p99": percentile(latency, 0.99),
+            "max": max(latency) if latency else 0,
+        }
+        # kilobytes on Linux, bytes on OSX
+        results["peakRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        window.close()
+        app.quit()
+
+    populateTimer = QTimer()
+    populateTimer.timeout.connect(checkPopulated)
+    populateTimer.start(50)
+
+    probeTimer = QTimer()
+    probeTimer.timeout.connect(probe)
+    probeTimer.start(10)
+
+    QTimer.singleShot(int(options.warmup * 1000), startMeasuring)
+    QTimer.singleShot(int((options.warmup + options.duration) * 1000), finish)
+
+    try:
+        app.exec_()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    with open(options.output, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load benchmark for the ZOCP Node Editor")
+    parser.add_argument("--peers", type=int, default=20,
+        help="number of simulated peers")
+    parser.add_argument("--ports", type=int, default=10,
+        help="number of output ports per peer")
+    parser.add_argument("--types", default=",".join(typeHints),
+        help="comma separated type hints to cycle through (%s)" % ", ".join(typeHints))
+    parser.add_argument("--topology", choices=topologies, default="chain",
+        help="subscriptions between the simulated peers")
+    parser.add_argument("--rate", type=float, default=30,
+        help="signals per second per port")
+    parser.add_argument("--warmup", type=float, default=5,
+        help="seconds to wait before signals are emitted and measured")
+    parser.add_argument("--duration", type=float, default=20,
+        help="seconds to measure")
+    parser.add_argument("--output", default="znebench.json",
+        help="file to write the results to")
+    parser.add_argument("--peer", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.peer:
+        runPeer(json.loads(options.peer))
+    else:
+        runBenchmark(options)
@@ -0,0 +1,290 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+
+from PySide.QtCore import (QThread, Signal)
+
+# A network description maps peer names to their capability trees, in the
+# same layout ZOCP uses for peer capabilities. Subscribers are stored as
+# [peer name, port name] so a description can be restored in a later
+# session, when all peers have new uuids. This is the layout of the files
+# pyZConfigManager wrote, which are read as well; subscribers in those may
+# also name their peer by uuid, as ZOCP itself does.
+
+metadataKeys = ["_zne_position"]
+
+
+def describeNetwork(model):
+    names = dict((peer.hex, peer.name) for peer in model.peers.values())
+
+    description = {}
+    for peer in model.peers.values():
+        tree = {}
+        for key in metadataKeys:
+            if key in peer.metadata:
+                tree[key] = peer.metadata[key]
+
+        for capability in peer.capabilities.values():
+            data = {}
+            if capability.attributes:
+                data.update(capability.attributes)
+            data["value"] = capability.value
+            data["typeHint"] = capability.typeHint
+            data["access"] = capability.access
+            data["subscribers"] = sorted([names[uuid], portname]
+                for (uuid, portname) in capability.subscribers if uuid in names)
+            tree[capability.name] = data
+
+        description[peer.name] = tree
+
+    return description
+
+
+def writeDescription(fileName, description, progress = None, cancelled = None):
+    # written to a temporary file first, so a cancelled or failed save
+    # leaves an existing file untouched
+    tempName = fileName + ".part"
+    names = sorted(description)
+    try:
+        with open(tempName, "w") as output:
+            output.write("{")
+            for (index, name) in enumerate(names):
+                if cancelled and cancelled():
+                    break
+                if index:
+                    output.write(",")
+                output.write("\n  %s: %s" % (json.dumps(name),
+                    json.dumps(description[name], sort_keys=True)))
+                if progress:
+                    progress(int(100 * (index + 1) / len(names)))
+            output.write("\n}\n")
+    except:
+        if os.path.exists(tempName):
+            os.remove(tempName)
+        raise
+
+    if cancelled and cancelled():
+        os.remove(tempName)
+        return None
+
+    os.replace(tempName, fileName)
+    return fileName
+
+
+def readDescription(fileName, progress = None, cancelled = None):
+    size = max(1, os.path.getsize(fileName))
+    chunks = []
+    read = 0
+    with open(fileName, "r") as input:
+        while True:
+            if cancelled and cancelled():
+                return None
+            chunk = input.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            read += len(chunk)
+            if progress:
+                progress(min(99, int(100 * read / size)))
+
+    description = normalizeDescription(json.loads("".join(chunks)))
+    if description is None:
+        raise ValueError("%s does not contain a network description" % fileName)
+    if progress:
+        progress(100)
+
+    return description
+
+
+def normalizeDescription(description):
+    # makes every subscriber in a parsed description a [peer, port name]
+    # pair and drops the entries that can not be restored; returns None if
+    # it is not a description at all
+    if not isinstance(description, dict):
+        return None
+
+    normalized = {}
+    for (name, tree) in description.items():
+        if not isinstance(tree, dict):
+            continue
+        normalized[name] = tree
+        for (key, data) in tree.items():
+            if isinstance(data, dict) and "subscribers" in data:
+                subscribers = data["subscribers"]
+                if not isinstance(subscribers, list):
+                    subscribers = []
+                data["subscribers"] = [[str(subscriber[0]), str(subscriber[1])]
+                    for subscriber in subscribers
+                    if isinstance(subscriber, (list, tuple)) and len(subscriber) == 2]
+
+    return normalized
+
+
+class ZNERestoreStep(object):
+    # the changes needed to bring one live peer in line with a description;
+    # values is the data for a single peer_set call, subscribe and
+    # unsubscribe hold (recv peer, receiver, emitter) tuples
+    __slots__ = ("peer", "values", "subscribe", "unsubscribe")
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.values = {}
+        self.subscribe = []
+        self.unsubscribe = []
+
+
+    def isEmpty(self):
+        return not (self.values or self.subscribe or self.unsubscribe)
+
+
+def planRestore(description, model):
+    # compares the description with the live state in the model and
+    # returns a ZNERestoreStep per peer that differs; peers are matched by
+    # name, so live peers that share a name each get a step of their own
+    peers = {}
+    for peer in sorted(model.peers.values(), key=lambda peer: peer.hex):
+        peers.setdefault(peer.name, []).append(peer)
+    restored = set(peer.hex for name in description for peer in peers.get(name, ()))
+
+    def receiverPeers(recvName):
+        # by name, or by uuid for subscribers saved in the ZOCP layout
+        if recvName in peers:
+            return peers[recvName]
+        peer = model.peer(recvName.replace("-", "").lower())
+        return [peer] if peer else []
+
+    plan = []
+    for name in sorted(description):
+        tree = description[name]
+        for peer in peers.get(name, ()):
+            step = planPeer(model, peer, tree, receiverPeers, restored)
+            if not step.isEmpty():
+                plan.append(step)
+
+    return plan
+
+
+def planPeer(model, peer, tree, receiverPeers, restored):
+    step = ZNERestoreStep(peer)
+
+    for key in sorted(tree):
+        data = tree[key]
+        if key in metadataKeys:
+            if peer.metadata.get(key) != data:
+                step.values[key] = data
+            continue
+        if not isinstance(data, dict):
+            continue
+
+        capability = peer.capabilities.get(key)
+        if capability is None:
+            continue
+
+        if "w" in capability.access and "value" in data and capability.value != data["value"]:
+            step.values[key] = {"value": data["value"]}
+
+        if "subscribers" in data:
+            wanted = {}
+            for (recvName, receiver) in data["subscribers"]:
+                for recvPeer in receiverPeers(recvName):
+                    wanted[(recvPeer.hex, receiver)] = recvPeer
+            # subscriptions to peers that are not in the description are
+            # left alone
+            current = set(subscriber for subscriber in capability.subscribers
+                if subscriber[0] in restored)
+            for subscriber in sorted(set(wanted) - current):
+                step.subscribe.append((wanted[subscriber], subscriber[1], key))
+            for subscriber in sorted(current - set(wanted)):
+                step.unsubscribe.append((model.peers[subscriber[0]], subscriber[1], key))
+
+    return step
+
+
+def describePlan(plan):
+    # returns a one line summary and a detailed listing of the changes
+    values = sum(len(step.values) for step in plan)
+    subscribe = sum(len(step.subscribe) for step in plan)
+    unsubscribe = sum(len(step.unsubscribe) for step in plan)
+    summary = ("%d values on %d peers will be set, %d subscriptions added and %d removed." %
+        (values, len(plan), subscribe, unsubscribe))
+
+    # peers that share a name are told apart by their uuid
+    names = {}
+    for step in plan:
+        names[step.peer.name] = names.get(step.peer.name, 0) + 1
+    lines = []
+    for step in plan:
+        if names[step.peer.name] > 1:
+            lines.append("%s (%s)" % (step.peer.name, step.peer.uuid))
+        else:
+            lines.append(step.peer.name)
+        for key in sorted(step.values):
+            data = step.values[key]
+            if isinstance(data, dict):
+                data = data["value"]
+            lines.append("  set %s to %s" % (key, data))
+        for (recvPeer, receiver, emitter) in step.subscribe:
+            lines.append("  subscribe %s on %s to %s" % (receiver, recvPeer.name, emitter))
+        for (recvPeer, receiver, emitter) in step.unsubscribe:
+            lines.append("  unsubscribe %s on %s from %s" % (receiver, recvPeer.name, emitter))
+
+    return (summary, "\n".join(lines))
+
+
+class ZNEConfigWorker(QThread):
+    # Runs writeDescription or readDescription off the GUI thread
+    progress = Signal(int)
+    completed = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, parent, task, *args):
+        super(ZNEConfigWorker, self).__init__(parent)
+
+        self.task = task
+        self.args = args
+        self.m_cancelled = False
+
+
+    def run(self):
+        try:
+            result = self.task(*self.args, progress=self.progress.emit,
+                cancelled=self.isCancelled)
+        except (IOError, OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            return
+
+        if not self.m_cancelled:
+            self.completed.emit(result)
+
+
+    def cancel(self):
+        self.m_cancelled = True
+
+
+    def isCancelled(self):
+        return self.m_cancelled
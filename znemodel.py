@@ -0,0 +1,445 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from array import array
+
+class ZNECapability(object):
+    __slots__ = ("name", "typeHint", "access", "value", "subscribers", "attributes",
+        "history")
+
+    def __init__(self, name):
+        self.name = name
+        self.typeHint = ""
+        self.access = ""
+        self.value = None
+        self.subscribers = frozenset()
+        self.attributes = None
+        self.history = None
+
+
+    def update(self, data):
+        # returns the names of the fields that changed; peers often resend
+        # their whole capability tree, so most fields are usually the same
+        fields = []
+        for field in data:
+            value = data[field]
+            if field == "value":
+                if type(value) is type(self.value) and value == self.value:
+                    continue
+                self.value = value
+            elif field == "access":
+                value = str(value)
+                if value == self.access:
+                    continue
+                self.access = value
+            elif field == "typeHint":
+                value = str(value)
+                if value == self.typeHint:
+                    continue
+                self.typeHint = value
+            elif field == "subscribers":
+                value = frozenset(tuple(subscriber) for subscriber in value)
+                if value == self.subscribers:
+                    continue
+                self.subscribers = value
+            else:
+                if self.attributes is None:
+                    self.attributes = {}
+                elif field in self.attributes and self.attributes[field] == value:
+                    continue
+                self.attributes[field] = value
+            fields.append(field)
+
+        return fields
+
+
+    def historyChannels(self):
+        # number of channels of a history for this capability, or 0 if its
+        # values are not numeric
+        typeHint = self.typeHint
+        if typeHint in ("int", "flt", "percent"):
+            return 1
+        if typeHint.startswith("vec") and typeHint.endswith("f") and len(typeHint) == 5:
+            return int(typeHint[3])
+        return 0
+
+
+    def canSet(self):
+        return "s" in self.access
+
+
+    def canEmit(self):
+        return "e" in self.access
+
+
+class ZNEHistory(object):
+    # Fixed size ring buffer of recent numeric samples, with one channel per
+    # vector component. All memory is allocated up front.
+    __slots__ = ("size", "channels", "samples", "index", "count")
+
+    def __init__(self, size, channels = 1):
+        self.size = size
+        self.channels = channels
+        self.samples = array("d", [0.0]) * (size * channels)
+        self.index = 0
+        self.count = 0
+
+
+    def append(self, value):
+        if self.channels == 1:
+            self.samples[self.index] = float(value)
+        else:
+            offset = self.index * self.channels
+            for channel in range(self.channels):
+                self.samples[offset + channel] = float(value[channel])
+
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+
+    def values(self, channel = 0):
+        # samples of a channel, from oldest to newest
+        values = self.samples[channel::self.channels]
+        if self.count < self.size:
+            return values[:self.count]
+        return values[self.index:] + values[:self.index]
+
+
+    def range(self):
+        if self.count < self.size:
+            samples = self.samples[:self.count * self.channels]
+        else:
+            samples = self.samples
+        if not samples:
+            return (0.0, 0.0)
+        return (min(samples), max(samples))
+
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+
+class ZNEPeer(object):
+    __slots__ = ("uuid", "hex", "name", "capabilities", "metadata")
+
+    def __init__(self, uuid, name):
+        self.uuid = uuid
+        self.hex = uuid.hex
+        self.name = name
+        self.capabilities = {}
+        self.metadata = {}
+
+
+class ZNENetworkModel(object):
+    # Plain python state of the ZOCP network as seen by the editor. The ZOCP
+    # callbacks feed this model; listeners receive change notifications
+    # through their onModel... methods, which are all optional.
+
+    def __init__(self):
+        self.peers = {}
+        self.m_listeners = []
+
+        # the subscribers of all capabilities, by receiving peer and port:
+        # {recv peer: {receiver: set of (emit peer, emitter)}}
+        self.m_subscriptions = {}
+
+        # signal histories are bounded to maxHistories buffers of
+        # historySize samples per channel
+        self.historySize = 256
+        self.maxHistories = 200
+        self.historyCount = 0
+
+        # capability updates that changed something, and those that did not
+        self.updatesApplied = 0
+        self.updatesSkipped = 0
+
+
+    def addListener(self, listener):
+        self.m_listeners.append(listener)
+
+
+    def removeListener(self, listener):
+        self.m_listeners.remove(listener)
+
+
+    def notify(self, method, *args):
+        for listener in self.m_listeners:
+            callback = getattr(listener, method, None)
+            if callback:
+                callback(*args)
+
+
+    def peer(self, hex):
+        return self.peers.get(hex)
+
+
+    def capability(self, hex, name):
+        peer = self.peers.get(hex)
+        if peer is None:
+            return None
+        return peer.capabilities.get(name)
+
+
+    def subscriptionsTo(self, hex):
+        # the subscriptions the ports of a peer receive, by port name
+        return self.m_subscriptions.get(hex, {})
+
+
+    def indexSubscribers(self, hex, name, old, new):
+        # updates the subscriptions by receiver for the capability name of
+        # peer hex, whose subscribers changed from old to new
+        emitKey = (hex, name)
+        for (recvPeer, receiver) in old - new:
+            receivers = self.m_subscriptions[recvPeer]
+            receivers[receiver].discard(emitKey)
+            if not receivers[receiver]:
+                del receivers[receiver]
+                if not receivers:
+                    del self.m_subscriptions[recvPeer]
+        for (recvPeer, receiver) in new - old:
+            self.m_subscriptions.setdefault(recvPeer, {}).setdefault(receiver, set()).add(emitKey)
+
+
+    def peerEnter(self, uuid, name):
+        peer = ZNEPeer(uuid, name)
+        self.peers[peer.hex] = peer
+        self.notify("onModelPeerAdded", peer)
+
+        return peer
+
+
+    def peerExit(self, uuid):
+        peer = self.peers.pop(uuid.hex, None)
+        if peer:
+            for capability in peer.capabilities.values():
+                if capability.history is not None:
+                    capability.history = None
+                    self.historyCount -= 1
+                # the capability keeps its subscribers, so listeners can
+                # still see what the peer was connected to
+                self.indexSubscribers(peer.hex, capability.name, capability.subscribers, frozenset())
+            self.notify("onModelPeerRemoved", peer)
+
+
+    def setHistoryEnabled(self, hex, name, enabled):
+        # returns whether the capability keeps a history afterwards
+        capability = self.capability(hex, name)
+        if capability is None:
+            return False
+
+        if not enabled:
+            if capability.history is not None:
+                capability.history = None
+                self.historyCount -= 1
+            return False
+
+        if capability.history is None:
+            channels = capability.historyChannels()
+            if not channels or self.historyCount >= self.maxHistories:
+                return False
+            capability.history = ZNEHistory(self.historySize, channels)
+            self.historyCount += 1
+
+        return True
+
+
+    def peerModified(self, uuid, data):
+        peer = self.peers.get(uuid.hex)
+        if peer is None:
+            return
+
+        added = []
+        changed = []
+        subscribers = []
+        metadata = []
+        for name in data:
+            portdata = data[name]
+            capability = peer.capabilities.get(name)
+            if capability is not None:
+                old = capability.subscribers
+                fields = capability.update(portdata)
+                if fields:
+                    changed.append((capability, fields))
+                    self.updatesApplied += 1
+                else:
+                    self.updatesSkipped += 1
+            elif isinstance(portdata, dict) and "access" in portdata:
+                old = frozenset()
+                capability = ZNECapability(name)
+                capability.update(portdata)
+                peer.capabilities[name] = capability
+                added.append(capability)
+            else:
+                # Metadata, not a capability
+                if name in peer.metadata and peer.metadata[name] == portdata:
+                    self.updatesSkipped += 1
+                    continue
+                peer.metadata[name] = portdata
+                metadata.append(name)
+                self.updatesApplied += 1
+                continue
+
+            if capability.subscribers != old:
+                self.indexSubscribers(peer.hex, name, old, capability.subscribers)
+                subscribers.append((capability, old))
+
+        if added:
+            self.notify("onModelCapabilitiesAdded", peer, added)
+        for (capability, fields) in changed:
+            self.notify("onModelCapabilityChanged", peer, capability, fields)
+        for (capability, old) in subscribers:
+            self.notify("onModelSubscribersChanged", peer, capability, old)
+        for name in metadata:
+            self.notify("onModelMetadataChanged", peer, name, peer.metadata[name])
+        self.notify("onModelPeerModified", peer)
+
+
+    def peerSignaled(self, uuid, name, value):
+        peer = self.peers.get(uuid.hex)
+        if peer is None:
+            return
+
+        capability = peer.capabilities.get(name)
+        if capability is None:
+            return
+
+        capability.value = value
+        if capability.history is not None:
+            try:
+                capability.history.append(value)
+            except (TypeError, ValueError, IndexError):
+                pass
+        self.notify("onModelValueSignaled", peer, capability)
+
+
+class ZNEPendingSubscribers(object):
+    # Subscriptions whose receiving port does not exist yet. They are kept
+    # by peer and port name only, indexed by receiving port so they resolve
+    # as soon as that port is created, and by emitting port and peer so
+    # they can be dropped when the emitter goes away. Subscriptions that
+    # stay unresolved for longer than timeout seconds expire.
+
+    def __init__(self, timeout = 60.0):
+        self.timeout = timeout
+        self.byReceiver = {}
+        self.byEmitter = {}
+        self.byEmitterPeer = {}
+        self.resolvedCount = 0
+        self.expiredCount = 0
+
+
+    def add(self, emitKey, recvKey, now):
+        # adding a subscription again keeps its original deadline
+        self.byReceiver.setdefault(recvKey, {}).setdefault(emitKey, now + self.timeout)
+        self.byEmitter.setdefault(emitKey, set()).add(recvKey)
+        self.byEmitterPeer.setdefault(emitKey[0], set()).add(emitKey[1])
+
+
+    def discard(self, emitKey, recvKey):
+        emitters = self.byReceiver.get(recvKey)
+        if emitters is None or emitKey not in emitters:
+            return
+
+        del emitters[emitKey]
+        if not emitters:
+            del self.byReceiver[recvKey]
+
+        receivers = self.byEmitter[emitKey]
+        receivers.discard(recvKey)
+        if not receivers:
+            del self.byEmitter[emitKey]
+            ports = self.byEmitterPeer[emitKey[0]]
+            ports.discard(emitKey[1])
+            if not ports:
+                del self.byEmitterPeer[emitKey[0]]
+
+
+    def resolve(self, recvKey):
+        # removes and returns the emitters waiting for a receiving port
+        emitters = list(self.byReceiver.get(recvKey, ()))
+        for emitKey in emitters:
+            self.discard(emitKey, recvKey)
+        self.resolvedCount += len(emitters)
+
+        return emitters
+
+
+    def discardEmitter(self, emitKey, keep = ()):
+        # drops the subscriptions of an emitting port, except those to the
+        # receivers in keep
+        for recvKey in list(self.byEmitter.get(emitKey, ())):
+            if recvKey not in keep:
+                self.discard(emitKey, recvKey)
+
+
+    def discardPeer(self, hex):
+        for emitter in list(self.byEmitterPeer.get(hex, ())):
+            self.discardEmitter((hex, emitter))
+
+
+    def expire(self, now):
+        expired = [(emitKey, recvKey) for (recvKey, emitters) in self.byReceiver.items()
+            for (emitKey, deadline) in emitters.items() if deadline < now]
+        for (emitKey, recvKey) in expired:
+            self.discard(emitKey, recvKey)
+        self.expiredCount += len(expired)
+
+        return len(expired)
+
+
+    def clear(self):
+        self.byReceiver = {}
+        self.byEmitter = {}
+        self.byEmitterPeer = {}
+
+
+    def isEmpty(self):
+        return not self.byReceiver
+
+
+    def __len__(self):
+        return sum(len(emitters) for emitters in self.byReceiver.values())
+
+
+def parseValue(typeHint, value):
+    # converts text entered by the user to a value for the typeHint;
+    # returns (valid, value)
+    try:
+        if typeHint == "int":
+            return (True, int(float(value)))
+        elif typeHint == "flt" or typeHint == "percent":
+            return (True, float(value.strip()))
+        elif typeHint == "bool":
+            return (True, value.strip().lower() in ["true", "yes", "1"])
+        elif typeHint.startswith("vec") and typeHint.endswith("f") and len(typeHint) == 5:
+            value = [float(num) for num in ((value.strip())[1:-1]).split(",")]
+            return (len(value) == int(typeHint[3]), value)
+    except (ValueError, OverflowError):
+        return (False, value)
+
+    return (True, value)
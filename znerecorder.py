@@ -0,0 +1,255 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import mmap
+import struct
+import time
+import uuid
+
+import queue
+
+from PySide.QtCore import (QObject, QThread, QTimer, Signal)
+
+# A recording is a header followed by length-prefixed records. Each record
+# holds a timestamp, the kind of event, the peer uuid and name, and the
+# event data as JSON. Records are only ever appended, so a recording that
+# was cut short is valid up to its last complete record.
+
+(PeerEnter, PeerExit, PeerModified, PeerSignaled) = (1, 2, 3, 4)
+
+recordingMagic = b"ZNEREC\x00\x01"
+lengthFormat = struct.Struct("<I")
+eventFormat = struct.Struct("<dB16sH")
+
+
+def encodeEvent(timestamp, kind, peer, name, data):
+    name = name.encode("utf-8")
+    data = json.dumps(data, default=str).encode("utf-8")
+    payload = eventFormat.pack(timestamp, kind, peer.bytes, len(name)) + name + data
+    return lengthFormat.pack(len(payload)) + payload
+
+
+def recordEnd(buffer, offset):
+    # returns the offset after the record at offset, or None if there is no
+    # complete record there
+    start = offset + lengthFormat.size
+    if start > len(buffer):
+        return None
+    (length, ) = lengthFormat.unpack_from(buffer, offset)
+    end = start + length
+    if end > len(buffer):
+        return None
+
+    return end
+
+
+def decodeEvent(buffer, offset):
+    # returns the event at offset and the offset of the next one, or None
+    # at the end of the recording; raises ValueError for a complete record
+    # that can not be decoded, which recordEnd can skip
+    end = recordEnd(buffer, offset)
+    if end is None:
+        return (None, offset)
+    start = offset + lengthFormat.size
+    if end - start < eventFormat.size:
+        raise ValueError("record at %d is too short" % offset)
+
+    (timestamp, kind, peer, nameLength) = eventFormat.unpack_from(buffer, start)
+    nameStart = start + eventFormat.size
+    if nameStart + nameLength > end:
+        raise ValueError("record at %d has an invalid name" % offset)
+    name = buffer[nameStart:nameStart + nameLength].decode("utf-8")
+    data = json.loads(buffer[nameStart + nameLength:end].decode("utf-8"))
+
+    if kind == PeerModified and not isinstance(data, dict):
+        raise ValueError("record at %d has invalid capabilities" % offset)
+    elif kind == PeerSignaled and not (isinstance(data, list) and len(data) == 2):
+        raise ValueError("record at %d has an invalid signal" % offset)
+    elif kind not in (PeerEnter, PeerExit, PeerModified, PeerSignaled):
+        raise ValueError("record at %d has an unknown kind" % offset)
+
+    return ((timestamp, kind, uuid.UUID(bytes=peer), name, data), end)
+
+
+class ZNERecorder(QThread):
+    # Appends events to a recording. record() only queues the event, so it
+    # is cheap enough to call from the ZOCP callbacks; encoding and writing
+    # happen in this thread
+    failed = Signal(str)
+
+    def __init__(self, parent, fileName):
+        super(ZNERecorder, self).__init__(parent)
+
+        self.fileName = fileName
+        self.events = queue.Queue()
+        self.eventCount = 0
+
+
+    def record(self, kind, peer, name, data = None):
+        self.eventCount += 1
+        self.events.put((time.time(), kind, peer, name, data))
+
+
+    def stop(self):
+        self.events.put(None)
+        self.wait()
+
+
+    def run(self):
+        try:
+            with open(self.fileName, "wb") as output:
+                output.write(recordingMagic)
+                while True:
+                    event = self.events.get()
+                    if event is None:
+                        break
+                    output.write(encodeEvent(*event))
+                    if self.events.empty():
+                        output.flush()
+        except (IOError, OSError) as e:
+            self.failed.emit(str(e))
+
+
+class ZNEReplay(QObject):
+    # Feeds a recording to handler(kind, peer, name, data), either at the
+    # pace it was recorded at or as fast as possible. The recording is
+    # memory mapped, so it is never read into memory as a whole
+    finished = Signal()
+
+    def __init__(self, parent, fileName, handler, realTime = True):
+        super(ZNEReplay, self).__init__(parent)
+
+        self.handler = handler
+        self.realTime = realTime
+        # budget per timer tick, so the GUI stays responsive
+        self.budget = 0.02
+        self.eventCount = 0
+        self.skippedCount = 0
+
+        self.file = open(fileName, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.file.close()
+            raise ValueError("%s is not a recording" % fileName)
+        if self.buffer[:len(recordingMagic)] != recordingMagic:
+            self.close()
+            raise ValueError("%s is not a recording" % fileName)
+
+        self.offset = len(recordingMagic)
+        self.startTime = None
+        self.recordStartTime = None
+        (self.nextEvent, self.nextOffset) = self.decodeNext(self.offset)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.onTimer)
+
+
+    def start(self):
+        if self.nextEvent is None:
+            self.stop()
+            return
+
+        self.startTime = time.time()
+        self.recordStartTime = self.nextEvent[0]
+        self.timer.start(0)
+
+
+    def stop(self):
+        self.timer.stop()
+        self.close()
+        self.finished.emit()
+
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+            self.file.close()
+
+
+    def isActive(self):
+        return self.buffer is not None
+
+
+    def progress(self):
+        if self.buffer is None:
+            return 100
+        return int(100 * self.offset / max(1, len(self.buffer)))
+
+
+    def decodeNext(self, offset):
+        # damaged records are skipped and counted, so they do not end the
+        # replay
+        while True:
+            try:
+                return decodeEvent(self.buffer, offset)
+            except ValueError:
+                self.skippedCount += 1
+                offset = recordEnd(self.buffer, offset)
+
+
+    def onTimer(self):
+        deadline = time.time() + self.budget
+        while self.nextEvent is not None:
+            now = time.time()
+            if self.realTime:
+                due = self.startTime + self.nextEvent[0] - self.recordStartTime
+                if due > now:
+                    self.timer.start(int(1000 * (due - now)))
+                    return
+            if now > deadline:
+                self.timer.start(0)
+                return
+
+            (timestamp, kind, peer, name, data) = self.nextEvent
+            self.offset = self.nextOffset
+            (self.nextEvent, self.nextOffset) = self.decodeNext(self.offset)
+            self.eventCount += 1
+            self.handler(kind, peer, name, data)
+
+        self.stop()
+
+
+class ZNEMutedZOCP(object):
+    # Stands in for the ZOCP node while a recording is replayed, so the
+    # replayed network never sends anything to the live one
+    mutedCalls = ("peer_set", "signal_subscribe", "signal_unsubscribe")
+
+    def __init__(self, zocp):
+        self.zocp = zocp
+
+
+    def __getattr__(self, name):
+        if name in self.mutedCalls:
+            return self.ignore
+        return getattr(self.zocp, name)
+
+
+    def ignore(self, *args, **kwargs):
+        pass
@@ -0,0 +1,177 @@
+# Copyright (c) 2015, ALDO HOEBEN
+#All rights reserved.
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of STANISLAW ADASZEWSKI nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#DISCLAIMED. IN NO EVENT SHALL STANISLAW ADASZEWSKI BE LIABLE FOR ANY
+#DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# An incrementally maintained n-gram index over peer names, port names and
+# port values. Every text is indexed by all of its substrings of up to
+# gramSize characters, so a query is answered by intersecting the postings
+# of its own n-grams and checking the few candidates that remain, without
+# walking all peers and ports.
+
+(PeerName, PortName, PortValue) = (0, 1, 2)
+
+gramSize = 3
+# longer values are only searchable by their start
+maxValueLength = 64
+
+
+def textGrams(text):
+    grams = set()
+    for size in range(1, gramSize + 1):
+        for start in range(len(text) - size + 1):
+            grams.add(text[start:start + size])
+    return grams
+
+
+def queryGrams(query):
+    if len(query) <= gramSize:
+        return [query]
+    return [query[start:start + gramSize] for start in range(len(query) - gramSize + 1)]
+
+
+class ZNESearchIndex(object):
+    # Entries are keyed by (peer hex, port name or None, field). The
+    # methods that change the index return whether anything changed.
+
+    def __init__(self):
+        self.texts = {}
+        self.postings = {}
+        self.peerEntries = {}
+        self.peerPorts = {}
+
+
+    def setText(self, key, text):
+        text = text.lower()
+        old = self.texts.get(key)
+        if old == text:
+            return False
+
+        if old is not None:
+            self.removeGrams(key, old)
+        self.texts[key] = text
+        self.peerEntries.setdefault(key[0], set()).add(key)
+        for gram in textGrams(text):
+            self.postings.setdefault(gram, set()).add(key)
+
+        return True
+
+
+    def removeText(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return False
+
+        self.removeGrams(key, text)
+        keys = self.peerEntries[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.peerEntries[key[0]]
+
+        return True
+
+
+    def removeGrams(self, key, text):
+        for gram in textGrams(text):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+
+    def addPeer(self, hex, name):
+        return self.setText((hex, None, PeerName), name)
+
+
+    def updatePort(self, hex, name, value):
+        self.peerPorts.setdefault(hex, set()).add(name)
+        changed = self.setText((hex, name, PortName), name)
+        return self.setText((hex, name, PortValue), str(value)[:maxValueLength]) or changed
+
+
+    def removePort(self, hex, name):
+        ports = self.peerPorts.get(hex)
+        if ports is None or name not in ports:
+            return False
+
+        ports.discard(name)
+        if not ports:
+            del self.peerPorts[hex]
+        self.removeText((hex, name, PortName))
+        self.removeText((hex, name, PortValue))
+
+        return True
+
+
+    def ports(self, hex):
+        # names of the indexed ports of a peer
+        return self.peerPorts.get(hex, frozenset())
+
+
+    def removePeer(self, hex):
+        self.peerPorts.pop(hex, None)
+        keys = self.peerEntries.pop(hex, ())
+        for key in keys:
+            self.removeGrams(key, self.texts.pop(key))
+
+        return bool(keys)
+
+
+    def clear(self):
+        self.texts = {}
+        self.postings = {}
+        self.peerEntries = {}
+        self.peerPorts = {}
+
+
+    def search(self, query, limit = 100):
+        # returns (key, text) pairs; prefix matches first, then peers
+        # before ports
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        postings = []
+        for gram in queryGrams(query):
+            keys = self.postings.get(gram)
+            if not keys:
+                return []
+            postings.append(keys)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            candidates &= keys
+            if not candidates:
+                return []
+
+        matches = [(key, self.texts[key]) for key in candidates if query in self.texts[key]]
+        matches.sort(key=lambda match: (not match[1].startswith(query), match[0][2], match[1]))
+
+        return matches[:limit]
+
+
+    def __len__(self):
+        return len(self.texts)